@@ -0,0 +1,352 @@
+"""load driver for the music cog against fake_lavalink.py
+
+$ python -m bench.music --guilds 50 --seconds 60 --latency 50 --track-seconds 20
+
+starts a fake lavalink node, gives every simulated guild a connected player and then has them
+play/skip/seek/queue at random while tracks end on their own, then prints the command:* and music:* tallies
+(the same ones the metrics command shows, durations in milliseconds)
+
+no discord connection is made, players get a made up voice session and commands are called
+straight on the cog with a stand-in context, so latency here is the cog + lavalink round trips only
+
+afterwards every guild presses the loop/shuffle/skip console buttons --presses times, once through
+the command invocation the buttons used to do (bench:console:command:*) and once through the player
+actions they call now (bench:console:action:*). interaction callbacks there cost --discord-latency
+and postgres calls (like the blame invocation insert) cost --db-latency
+"""
+
+import argparse
+import asyncio
+import collections
+import contextlib
+import pathlib
+import random
+import socket
+import sys
+import time
+from types import SimpleNamespace
+
+import discord
+import tabulate
+import wavelink
+from discord.ext import commands
+
+import core
+import utils
+from cogs.music import Music, nanika_bot_music_player
+from cogs.self.blame import Blame
+
+FAKE_LAVALINK = pathlib.Path(__file__).resolve().parent.parent / "fake_lavalink.py"
+PASSWORD = "bench"
+
+class FakePool:
+    # the search cache and player snapshots only ever miss and go nowhere, after a round trip
+    def __init__(self, latency):
+        self.latency = latency
+
+    async def fetchrow(self, *args):
+        await asyncio.sleep(self.latency)
+        return None
+
+    async def fetchval(self, *args):
+        await asyncio.sleep(self.latency)
+        return 1
+
+    async def fetch(self, *args):
+        await asyncio.sleep(self.latency)
+        return []
+
+    async def execute(self, *args):
+        await asyncio.sleep(self.latency)
+        return None
+
+    async def executemany(self, *args):
+        await asyncio.sleep(self.latency)
+        return None
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        yield self
+
+    def transaction(self):
+        return contextlib.nullcontext()
+
+BOT_USER = {"id": "1", "username": "nanika", "discriminator": "0", "avatar": None, "bot": True}
+
+class BenchBot(commands.Bot):
+    def __init__(self, *, db_latency):
+        super().__init__(command_prefix="!", intents=discord.Intents.none())
+        self.metrics = collections.defaultdict(utils.Tally)
+        self.pgpool = FakePool(db_latency)
+        self.defer_budget = 2.0
+        self._connection.user = discord.ClientUser(state=self._connection, data=BOT_USER)
+
+    async def start_offline(self):
+        # what login() would set up, so events get dispatched and wait_until_ready() returns
+        await self._async_setup_hook()
+        self._ready.set()
+
+class BenchContext:
+    """just the parts of nanika_ctx the music commands touch"""
+    def __init__(self, bot, guild, author):
+        self.bot = bot
+        self.guild = guild
+        self.author = author
+
+    @contextlib.asynccontextmanager
+    async def typing(self, **kwargs):
+        yield
+
+    async def send(self, *args, **kwargs):
+        return None
+
+    async def plain(self, *args, **kwargs):
+        return None
+
+    async def react(self, *args, **kwargs):
+        return None
+
+    def alway_ephemeral(self):
+        return self
+
+    async def paginate(self, navi):
+        navi.owner_id = self.author.id
+        thing = await discord.utils.maybe_coroutine(navi.source.peek, navi)
+        await navi.prepare(thing)
+
+class BenchSelf(Blame, name="Self"):
+    """just the blame part of the Self cog, its check-once and ctx.send hooks are what commands pay for"""
+
+class BenchMessage:
+    def __init__(self, message_id, channel):
+        self.id = message_id
+        self.channel = channel
+        self.guild = channel.guild
+
+    async def delete(self, *, delay=None):
+        return None
+
+class BenchResponse:
+    """interaction callbacks that only cost the made up discord latency"""
+    def __init__(self, interaction):
+        self._interaction = interaction
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def _respond(self):
+        if self._done:
+            raise discord.InteractionResponded(self._interaction)
+        self._done = True
+        await asyncio.sleep(self._interaction.latency)
+        # no message comes back with it, so ctx.send fetches it like it does on discord.py 2.4
+        return SimpleNamespace(resource=None)
+
+    async def defer(self, **kwargs):
+        return await self._respond()
+
+    async def send_message(self, *args, **kwargs):
+        return await self._respond()
+
+class BenchInteraction(discord.Interaction):
+    """a console button press that BenchResponse answers instead of discord"""
+    def __init__(self, bot, message, user_id, custom_id, *, latency):
+        channel = message.channel
+        super().__init__(data={
+            "id": str(discord.utils.time_snowflake(discord.utils.utcnow())),
+            "application_id": "1",
+            "type": 3,
+            "token": "bench",
+            "version": 1,
+            "guild_id": str(channel.guild.id),
+            "channel": {"id": str(channel.id), "type": 2},
+            "channel_id": str(channel.id),
+            "data": {"custom_id": custom_id, "component_type": 2},
+            "member": {
+                "user": {"id": str(user_id), "username": "bench", "discriminator": "0", "avatar": None},
+                "roles": [], "joined_at": None, "deaf": False, "mute": False, "flags": 0,
+            },
+            "message": message_payload(message.id, channel),
+            "attachment_size_limit": 8388608,
+        }, state=bot._connection)
+        self.latency = latency
+        self._bench_response = BenchResponse(self)
+
+    @property
+    def response(self):
+        return self._bench_response
+
+    async def original_response(self):
+        await asyncio.sleep(self.latency)
+        return BenchMessage(self.id, self.channel)
+
+def message_payload(message_id, channel):
+    """the console message the buttons are on"""
+    return {
+        "id": str(message_id), "channel_id": str(channel.id), "type": 0, "content": "",
+        "author": BOT_USER,
+        "attachments": [], "embeds": [], "mentions": [], "mention_roles": [], "pinned": False,
+        "mention_everyone": False, "tts": False, "timestamp": discord.utils.utcnow().isoformat(),
+        "edited_timestamp": None, "flags": 0, "components": [],
+    }
+
+def make_guild(bot, guild_id):
+    channel_id = guild_id + 1
+    guild = discord.Guild(data={
+        "id": str(guild_id),
+        "name": f"bench {guild_id}",
+        "channels": [{
+            "id": str(channel_id), "type": 2, "name": "vc", "position": 0,
+            "bitrate": 64000, "user_limit": 0, "permission_overwrites": [],
+        }],
+    }, state=bot._connection)
+    bot._connection._add_guild(guild)
+    return guild, guild.get_channel(channel_id)
+
+async def connect_player(bot, guild, channel):
+    player = nanika_bot_music_player(bot, channel)
+    player._guild = guild
+    player.node._players[guild.id] = player
+    bot._connection._add_voice_client(guild.id, player)
+    await player.on_voice_state_update({"channel_id": channel.id, "session_id": f"bench-{guild.id}"})
+    await player.on_voice_server_update({"token": "bench", "endpoint": "bench.invalid"})
+    return player
+
+async def run_command(bot, cog, name, ctx, *args, **kwargs):
+    command = bot.get_command(name)
+    started = time.perf_counter()
+    try:
+        await command.callback(cog, ctx, *args, **kwargs)
+    except commands.CommandError:
+        bot.metrics[f"bench:refused:{name}"].add()
+        return
+    bot.metrics[f"command:{name}"].add((time.perf_counter() - started) * 1000)
+
+async def drive_guild(bot, cog, guild, player, *, until, interval, rng):
+    ctx = BenchContext(bot, guild, discord.Object(id=guild.id + 2))
+    n = 0
+    while time.perf_counter() < until:
+        await asyncio.sleep(rng.expovariate(1.0 / interval))
+        action = rng.choices(("play", "skip", "seek", "queue"), weights=(4, 1, 2, 3))[0]
+        if action == "play" or not player.current:
+            n += 1
+            await run_command(bot, cog, "play", ctx, query=f"https://example.invalid/watch?v={guild.id}-{n}")
+        elif action == "skip":
+            await run_command(bot, cog, "skip", ctx)
+        elif action == "seek":
+            await run_command(bot, cog, "jump", ctx, str(rng.randint(0, max(player.current.length // 1000, 1))))
+        elif len(player.queue):
+            await run_command(bot, cog, "queue", ctx)
+
+# console button, command it used to invoke, player action it calls now
+CONSOLE = (
+    ("loop", "loop", "cycle_loop", False),
+    ("shuffle", "shuffle", "shuffle_queue", False),
+    ("skip", "skip", "skip_track", True),
+)
+
+async def press_console(bot, cog, guild, player, *, presses, latency):
+    ctx = BenchContext(bot, guild, discord.Object(id=guild.id + 2))
+    console = discord.Message(state=bot._connection, channel=player.channel, data=message_payload(guild.id + 3, player.channel))
+    n = 0
+    for _ in range(presses):
+        for button, command, action, and_track in CONSOLE:
+            for path in ("command", "action"):
+                if not player.current:
+                    # skip needs something playing to be the same work either way
+                    n += 1
+                    await run_command(bot, cog, "play", ctx, query=f"https://example.invalid/watch?v={guild.id}-console-{n}")
+                interaction = BenchInteraction(bot, console, ctx.author.id, f"audio:{button}", latency=latency)
+                started = time.perf_counter()
+                if path == "command":
+                    await cog.view.invoke_audio_command(command, interaction=interaction)
+                else:
+                    await cog.view.run_player_action(interaction, getattr(cog, action), and_track=and_track)
+                bot.metrics[f"bench:console:{path}:{button}"].add((time.perf_counter() - started) * 1000)
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+async def start_fake_lavalink(args, port):
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, str(FAKE_LAVALINK),
+        "--port", str(port), "--password", PASSWORD,
+        "--latency", str(args.latency), "--track-seconds", str(args.track_seconds),
+        "--update-interval", str(args.update_interval),
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL
+    )
+    for _ in range(100):
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+        except OSError:
+            await asyncio.sleep(0.1)
+        else:
+            writer.close()
+            return proc
+    proc.kill()
+    raise RuntimeError("fake lavalink didnt start")
+
+async def main(args):
+    port = free_port()
+    proc = await start_fake_lavalink(args, port)
+    bot = BenchBot(db_latency=args.db_latency / 1000)
+    await bot.start_offline()
+    try:
+        node = wavelink.Node(uri=f"http://127.0.0.1:{port}", password=PASSWORD, identifier="bench")
+        await wavelink.Pool.connect(nodes=[node], client=bot)
+        while node.status is not wavelink.NodeStatus.CONNECTED:
+            await asyncio.sleep(0.05)
+
+        # only idle_timeout is read from it and the reaper wont get there in a run
+        core.configs.setdefault("lavalink", {})
+        cog = Music(bot)
+        await bot.add_cog(cog)
+        await bot.add_cog(BenchSelf(bot))
+        players = []
+        for n in range(args.guilds):
+            guild, channel = make_guild(bot, 1000 + n * 10)
+            players.append((guild, await connect_player(bot, guild, channel)))
+
+        print(f"{args.guilds} guilds for {args.seconds:.0f}s, lavalink latency {args.latency:.0f}ms")
+        rng = random.Random(args.seed)
+        until = time.perf_counter() + args.seconds
+        await asyncio.gather(*(
+            drive_guild(bot, cog, guild, player, until=until, interval=args.interval, rng=rng)
+            for guild, player in players
+        ))
+        if args.presses:
+            print(f"console presses, discord latency {args.discord_latency:.0f}ms, postgres {args.db_latency:.0f}ms")
+            await asyncio.gather(*(
+                press_console(bot, cog, guild, player, presses=args.presses, latency=args.discord_latency / 1000)
+                for guild, player in players
+            ))
+        await bot.remove_cog(cog.qualified_name)
+    finally:
+        await wavelink.Pool.close()
+        proc.kill()
+        await proc.wait()
+
+    rows = [
+        [name, tally.count, f"{tally.mean:.3f}", f"{tally.peak:.3f}", f"{tally.total:.3f}"]
+        for name, tally in sorted(bot.metrics.items())
+        if name.startswith(("command:", "music:", "bench:"))
+    ]
+    print(tabulate.tabulate(rows, ["name", "count", "mean", "peak", "total"], tablefmt="psql"))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="music cog load driver")
+    parser.add_argument("--guilds", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=60.0)
+    parser.add_argument("--interval", type=float, default=2.0, help="mean seconds between commands per guild")
+    parser.add_argument("--latency", type=float, default=50.0, help="ms the fake node adds to every REST call")
+    parser.add_argument("--track-seconds", type=int, default=20)
+    parser.add_argument("--update-interval", type=float, default=1.0, help="seconds between playerUpdate ops")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--presses", type=int, default=10, help="presses of each console button per guild, 0 to skip")
+    parser.add_argument("--discord-latency", type=float, default=100.0, help="ms every interaction callback takes")
+    parser.add_argument("--db-latency", type=float, default=1.0, help="ms every postgres call takes")
+    asyncio.run(main(parser.parse_args()))
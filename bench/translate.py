@@ -0,0 +1,74 @@
+"""translate() throughput on a synthetic locale
+
+$ python -m bench.translate --messages 1600 --number 200000
+
+compares the cached (locale, message id) resolution against looking the message up
+through the bundles on every call like translate() used to
+"""
+
+import argparse
+import asyncio
+import collections
+import importlib.metadata
+import os
+import pathlib
+import tempfile
+import timeit
+from types import SimpleNamespace
+
+import discord
+
+import utils
+from core import i10n
+
+NATIVE = discord.Locale.british_english
+
+def write_locale(root, messages):
+    directory = pathlib.Path(root, NATIVE.value)
+    directory.mkdir(parents=True)
+    lines = []
+    for n in range(messages):
+        lines.append(f"plain-{n} = nothing to fill in here {n}")
+        lines.append(f"param-{n} = {{ $user }} has {{ NUMBER($count) }} things in slot {n}")
+        lines.append(f"    .title = title {n}")
+    (directory / "bench.ftl").write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+def lookup_every_call(translator, id_, locale, params):
+    # the per-call path translate() took before resolutions were cached
+    bundles = [translator.bundles[locale], translator.bundles[translator.native]]
+    initial, _, _ = id_.partition(".")
+    for bundle in bundles:
+        if bundle.has_message(initial):
+            translated, _ = bundle.format(id_, params)
+            if translated is not None:
+                return translated
+
+def report(name, fn, number):
+    best = min(timeit.repeat(fn, number=number, repeat=5))
+    print(f"{name:<32} {number / best:>12,.0f} calls/s  {best / number * 1e9:>8.0f} ns/call")
+
+async def main(args):
+    bot = SimpleNamespace(metrics=collections.defaultdict(utils.Tally))
+    with tempfile.TemporaryDirectory() as root:
+        write_locale(root, args.messages)
+        # the compiled bundle cache goes in the working directory
+        os.chdir(root)
+        translator = i10n.nanika_bot_translator(bot, filepath=root, native=NATIVE)
+        bot.tree = SimpleNamespace(translator=translator)
+        await translator.load_bundles()
+
+    middle = args.messages // 2
+    plain, param = f"plain-{middle}", f"param-{middle}"
+    params = {"user": "nanika", "count": 1234}
+    print(f"{args.messages * 3} messages, fluent_compiler {importlib.metadata.version('fluent_compiler')}")
+    report("parameterless, cached", lambda: i10n.translate(plain, NATIVE), args.number)
+    report("parameterless, every call", lambda: lookup_every_call(translator, plain, NATIVE, {}), args.number)
+    report("parameterised, cached", lambda: i10n.translate(param, NATIVE, **params), args.number)
+    report("parameterised, every call", lambda: lookup_every_call(translator, param, NATIVE, params), args.number)
+    report("attribute, cached", lambda: i10n.translate(f"{param}.title", NATIVE), args.number)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="translate() throughput")
+    parser.add_argument("--messages", type=int, default=1600)
+    parser.add_argument("--number", type=int, default=200_000, help="calls per timing run")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,235 @@
+import asyncio
+import json
+import logging
+import os
+import pathlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import mutagen
+import wavelink
+from discord.ext import commands
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+import core
+
+LOGGER = logging.getLogger(__name__)
+
+async def setup(bot):
+    await bot.add_cog(Library(bot))
+
+
+AUDIO_SUFFIXES = {".mp3", ".flac", ".ogg", ".opus", ".m4a", ".aac", ".wav", ".webm", ".mka", ".mp4"}
+
+# trigram word similarity a query needs before a local file wins over a remote search
+LOCAL_MATCH = 0.6
+
+def is_audio(path):
+    return path.suffix.casefold() in AUDIO_SUFFIXES
+
+def like_escape(text):
+    # so _ and % in directory names match themselves
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def walk_library(root):
+    """path -> (mtime, size) of every audio file under root"""
+    found = {}
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = pathlib.Path(directory, filename)
+            if not is_audio(path):
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            found[str(path)] = (stat.st_mtime, stat.st_size)
+    return found
+
+def read_tags(path):
+    """music_library row for a file, runs in the worker pool"""
+    stat = os.stat(path)
+    title = artist = album = None
+    length = None
+    try:
+        audio = mutagen.File(path, easy=True)
+    except Exception as exc:
+        LOGGER.debug(f"couldnt read tags of {path}", exc_info=exc)
+        audio = None
+    if audio is not None:
+        tags = audio.tags or {}
+        title, artist, album = (next(iter(tags.get(key) or ()), None) for key in ("title", "artist", "album"))
+        if audio.info and getattr(audio.info, "length", None):
+            length = int(audio.info.length * 1000)
+    return (path, title or pathlib.Path(path).stem, artist, album, length, stat.st_mtime, stat.st_size)
+
+
+class LibraryWatcher(FileSystemEventHandler):
+    # watchdog calls these from its own thread
+    def __init__(self, cog, loop):
+        super().__init__()
+        self.cog = cog
+        self.loop = loop
+
+    def _queue(self, path):
+        self.loop.call_soon_threadsafe(self.cog.queue_change, path)
+
+    def on_created(self, event):
+        self._queue(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self._queue(event.src_path)
+
+    def on_deleted(self, event):
+        self._queue(event.src_path)
+
+    def on_moved(self, event):
+        self._queue(event.src_path)
+        self._queue(event.dest_path)
+
+
+class Library(commands.Cog):
+    """index of the music directory lavalink's local source plays from"""
+    def __init__(self, bot):
+        self.bot = bot
+        self.root = core.configs["lavalink"].get("library")
+        self._pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="library")
+        self._observer = None
+        self._scanning = None
+        self._pending = set()
+        self._flushing = None
+
+    async def cog_load(self):
+        if not self.root:
+            return
+        self._observer = Observer()
+        self._observer.schedule(LibraryWatcher(self, asyncio.get_running_loop()), self.root, recursive=True)
+        self._observer.start()
+        self._scanning = asyncio.create_task(self.scan())
+
+    async def cog_unload(self):
+        if self._observer:
+            self._observer.stop()
+        for task in (self._scanning, self._flushing):
+            if task:
+                task.cancel()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    UPSERT_FILES = """
+        INSERT INTO music_library (path, title, artist, album, length, mtime, size)
+        VALUES ($1, $2, $3, $4, $5, $6, $7)
+        ON CONFLICT (path)
+        DO UPDATE SET title=EXCLUDED.title, artist=EXCLUDED.artist, album=EXCLUDED.album, length=EXCLUDED.length,
+                      mtime=EXCLUDED.mtime, size=EXCLUDED.size, track=NULL"""
+
+    async def _read_all(self, paths):
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(
+            *(loop.run_in_executor(self._pool, read_tags, path) for path in paths),
+            return_exceptions=True
+        )
+        # files can disappear between listing and reading
+        return [row for row in results if not isinstance(row, BaseException)]
+
+    async def scan(self):
+        """bring the table in line with the directory, only reading tags of new or changed files"""
+        started = time.perf_counter()
+        found = await asyncio.to_thread(walk_library, self.root)
+        known = {
+            record["path"]: (record["mtime"], record["size"])
+            for record in await self.bot.pgpool.fetch("SELECT path, mtime, size FROM music_library")
+        }
+        changed = [path for path, stat in found.items() if known.get(path) != stat]
+        gone = list(known.keys() - found.keys())
+
+        rows = await self._read_all(changed)
+        async with self.bot.pgpool.acquire() as c, c.transaction():
+            if rows:
+                await c.executemany(self.UPSERT_FILES, rows)
+            if gone:
+                await c.execute("DELETE FROM music_library WHERE path=any($1::text[])", gone)
+
+        elapsed = time.perf_counter() - started
+        self.bot.metrics["library:scan"].add(elapsed * 1000)
+        LOGGER.info(
+            f"library scan: {len(found)} files, {len(rows)} (re)indexed, {len(gone)} removed in {elapsed:.2f}s"
+        )
+        return len(found), len(rows), len(gone)
+
+    def queue_change(self, path):
+        self._pending.add(path)
+        if self._flushing is None or self._flushing.done():
+            self._flushing = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        while self._pending:
+            # let bursts (copying an album in) settle first
+            await asyncio.sleep(2.0)
+            paths, self._pending = self._pending, set()
+            try:
+                await self._apply(paths)
+            except Exception as exc:
+                LOGGER.error("applying library changes failed", exc_info=exc)
+
+    async def _apply(self, paths):
+        present = [p for p in paths if is_audio(pathlib.Path(p)) and os.path.isfile(p)]
+        missing = [p for p in paths if not os.path.exists(p)]
+        for directory in filter(os.path.isdir, paths):
+            # a directory moved in only sends one event for itself too
+            present.extend(await asyncio.to_thread(walk_library, directory))
+        rows = await self._read_all(present)
+        async with self.bot.pgpool.acquire() as c, c.transaction():
+            if rows:
+                await c.executemany(self.UPSERT_FILES, rows)
+            if missing:
+                # a removed directory only sends one event for itself
+                await c.execute(
+                    "DELETE FROM music_library WHERE path=any($1::text[]) OR path LIKE any($2::text[])",
+                    missing,
+                    [like_escape(p.rstrip(os.sep) + os.sep) + "%" for p in missing]
+                )
+        self.bot.metrics["library:changes"].add(len(paths))
+
+    async def match(self, query):
+        """best local file for a play query as a Playable, or None
+        lavalink is only asked the first time a file is played, after that the track payload comes from the table
+        """
+        if not self.root:
+            return None
+        record = await self.bot.pgpool.fetchrow("""
+            SELECT path, track, word_similarity($1, search) AS score
+            FROM music_library
+            WHERE $1 <% search
+            ORDER BY score DESC
+            LIMIT 1
+            """,
+            " ".join(query.casefold().split())
+        )
+        if not record or record["score"] < LOCAL_MATCH:
+            return None
+
+        if record["track"]:
+            return wavelink.Playable(json.loads(record["track"]))
+
+        found = await wavelink.Pool.fetch_tracks(record["path"])
+        if not found or isinstance(found, wavelink.Playlist):
+            return None
+        track = found[0]
+        await self.bot.pgpool.execute(
+            "UPDATE music_library SET track=$2::jsonb WHERE path=$1",
+            record["path"], json.dumps(track.raw_data, separators=(",", ":"))
+        )
+        self.bot.metrics["library:resolved"].add()
+        return track
+
+    @core.command()
+    @commands.is_owner()
+    async def library(self, ctx):
+        """rescan the local music directory"""
+        if not self.root:
+            return await ctx.send("no library directory configured")
+        async with ctx.typing():
+            total, indexed, removed = await self.scan()
+        await ctx.send(f"{total} files, {indexed} (re)indexed, {removed} removed")
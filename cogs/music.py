@@ -1,12 +1,16 @@
 import asyncio
 import datetime
+import json
 import logging
+import time
+from collections.abc import Iterable
 from typing import Literal
 
 import discord
+import tabulate
 import wavelink
-from discord import ui
-from discord.ext import commands
+from discord import app_commands, ui
+from discord.ext import commands, tasks
 
 import core
 import utils
@@ -74,6 +78,27 @@ class AudioPlayerView(utils.UsefulView, utils.ContextView):
     async def play(self, interaction, button):
         await interaction.response.send_modal(AudioPlayerModal(self))
 
+    async def run_player_action(self, interaction, action, *, and_track=False):
+        """console buttons that only poke the player skip the command machinery
+        same guild/voice checks as the commands, acknowledged with a deferred update unless theres something to say
+        """
+        started = time.perf_counter()
+        try:
+            if not interaction.guild:
+                raise VoiceError()
+            player = voice_player(interaction.guild, and_track=and_track)
+            message = await action(player)
+        except VoiceError as error:
+            await interaction.response.send_message(str(error), ephemeral=True, delete_after=5.0)
+            return
+
+        if message:
+            await interaction.response.send_message(message, ephemeral=True, delete_after=5.0)
+        else:
+            await interaction.response.defer()
+        self.cog.poke_live(interaction.guild.id, activity=True)
+        self.cog.bot.metrics[f"music:console:{action.__name__}"].add((time.perf_counter() - started) * 1000)
+
     async def invoke_audio_command(self, command, *, interaction=None, args=(), kwargs={}):
         cmd = self.cog.bot.get_command(command)
         # little cringe
@@ -89,9 +114,10 @@ class AudioPlayerView(utils.UsefulView, utils.ContextView):
             ctx.dont_parse()
         # now invoke command on the bot (dont forget check-onces nanika)
         await self.cog.bot.invoke(ctx)
-        if not ctx.interaction.response.is_done():
+        if not ctx.interaction.response.is_done() or ctx.auto_deferred:
             # the original command is "silent"
             # app commands need a message response so we need to do something minimal here
+            # (also replaces the watchdog's "thinking" placeholder if it fired)
             await ctx.send("\N{JOYSTICK}", ephemeral=True)
 
     @ui.button(
@@ -101,7 +127,7 @@ class AudioPlayerView(utils.UsefulView, utils.ContextView):
         custom_id="audio:loop"
     )
     async def loop(self, interaction, button):
-        await self.invoke_audio_command("loop")
+        await self.run_player_action(interaction, self.cog.cycle_loop)
 
     @ui.button(
         label=f"\N{RIGHTWARDS ARROW WITH HOOK}{VS15} skip",
@@ -110,7 +136,7 @@ class AudioPlayerView(utils.UsefulView, utils.ContextView):
         custom_id="audio:skip"
     )
     async def skip(self, interaction, button):
-        await self.invoke_audio_command("skip")
+        await self.run_player_action(interaction, self.cog.skip_track, and_track=True)
 
     @ui.button(
         label=f"\N{BLACK SQUARE FOR STOP}{VS15} disconnect",
@@ -119,7 +145,7 @@ class AudioPlayerView(utils.UsefulView, utils.ContextView):
         custom_id="audio:disconnect"
     )
     async def disconnect(self, interaction, button):
-        await self.invoke_audio_command("disconnect")
+        await self.run_player_action(interaction, self.cog.leave)
 
     @ui.button(
         label=f"\N{TWISTED RIGHTWARDS ARROWS}{VS15} shuffle queue",
@@ -128,7 +154,7 @@ class AudioPlayerView(utils.UsefulView, utils.ContextView):
         custom_id="audio:shuffle"
     )
     async def shuffle_queue(self, interaction, button):
-        await self.invoke_audio_command("shuffle")
+        await self.run_player_action(interaction, self.cog.shuffle_queue)
 
     @ui.button(
         label=f"\N{DOWNWARDS ARROW}{VS15} expand queue",
@@ -141,17 +167,264 @@ class AudioPlayerView(utils.UsefulView, utils.ContextView):
 
 NOT_CONNECTED_MSG = "im not connected to voice"
 
+# how close to the end of a track the next one gets checked
+# (player updates come every 5s per application.yml so this needs to be comfortably above that)
+LOOKAHEAD_MS = 15_000
+
+# searches younger than this are served as-is, older ones are still served but refreshed in the background
+SEARCH_FRESH = datetime.timedelta(hours=12)
+SEARCH_EXPIRE = datetime.timedelta(days=14)
+
+# how long a reaped queue is offered back on the next play
+PARKED_EXPIRE = datetime.timedelta(days=7)
+
+# live now playing: regular edit interval, minimum spacing when changes force an early edit
+# (message edits share a 5 per 5s bucket per channel) and how long it runs without anyone touching music
+LIVE_EDIT_INTERVAL = 5.0
+LIVE_MIN_GAP = 1.5
+LIVE_IDLE = 5 * 60.0
+
+# autocomplete: quiet time before a keystroke is searched, and the time it has to answer in
+# (discord gives up on autocomplete responses after 3s)
+SUGGEST_DEBOUNCE = 0.35
+SUGGEST_BUDGET = 2.5
+
+def normalise_query(query):
+    query = query.strip()
+    if query.startswith(("http://", "https://")):
+        # ids in urls are case sensitive
+        return query
+    return " ".join(query.casefold().split())
+
+def voice_player(guild, *, and_track=False):
+    player = guild.voice_client
+    if not player or not player.channel:
+        raise VoiceError(NOT_CONNECTED_MSG)
+    if and_track and not player.current:
+        raise VoiceError("nothing is playing atm")
+    return player
+
 def requires_voice(*, and_track=False):
     async def predicate(ctx):
-        player = ctx.guild.voice_client
-        if not player or not player.channel:
-            raise VoiceError(NOT_CONNECTED_MSG)
-        if and_track and not player.current:
-            raise VoiceError("nothing is playing atm")
+        voice_player(ctx.guild, and_track=and_track)
         return True
     return commands.check(predicate)
 
+LOOP_MESSAGES = {
+    wavelink.QueueMode.loop:     "now looping current track",
+    wavelink.QueueMode.loop_all: "now looping the queue",
+    wavelink.QueueMode.normal:   "not looping"
+}
+
+# lavalink's own suggested load balancing penalties
+def node_penalty(node):
+    stats = getattr(node, "nanika_stats", None)
+    if stats is None:
+        return len(node.players)
+    penalty = stats.playing + 1.05 ** (100 * stats.cpu.system_load) * 10 - 10
+    # frame stats are per minute (3000 frames) and only given when the node has some
+    if frames := stats.frames:
+        penalty += 1.03 ** (500 * frames.deficit / 3000) * 600 - 600
+        penalty += (1.03 ** (500 * frames.nulled / 3000) * 300 - 300) * 2
+    return penalty
+
+def node_is_healthy(node):
+    if node.status is not wavelink.NodeStatus.CONNECTED:
+        return False
+    stats = getattr(node, "nanika_stats", None)
+    if stats is None:
+        return getattr(node, "nanika_stats_failed", False) is False
+    if stats.cpu.system_load >= 0.95:
+        return False
+    # losing over half of the frames
+    return not stats.frames or stats.frames.deficit < 1500
+
+def pick_node(*, exclude=None):
+    nodes = [n for n in wavelink.Pool.nodes.values() if n is not exclude and node_is_healthy(n)]
+    return min(nodes, key=node_penalty, default=None)
+
+def delta_time(ms):
+    minutes, seconds = divmod(ms / 1000.0, 60.0)
+    hours, minutes = divmod(minutes, 60.0)
+    seconds, minutes, hours = (
+        (int(seconds)), int(minutes), int(hours)
+    )
+    if hours != 0:
+        return f"{hours}:{minutes:02}:{seconds:02}"
+    return f"{minutes}:{seconds:02}"
+
+def render_nowplaying(player):
+    track = player.current
+    if not track:
+        return "nothing is playing atm"
+    position = player.position
+    duration = track.length
+
+    gap, mark = ("─", "●")
+    width = 8
+    index = int((position / duration) * width) if duration else 0
+    progress_bar = (gap * (index - 1)) + mark + ((width - index) * gap)
+
+    hyperlink = f"[{discord.utils.escape_markdown(track.title)}]({track.uri})"
+    paused = " (paused)" if player.paused else ""
+    return (
+        f"{hyperlink}\n"
+        f"{delta_time(position)} {progress_bar} {delta_time(duration)}{paused}"
+    )
+
+class LiveNowPlaying:
+    """now playing message that keeps editing itself
+    changes (skip/seek/pause...) only wake it up early, so a burst of them becomes one edit
+    """
+    def __init__(self, player, message):
+        self.player = player
+        self.message = message
+        self.last_activity = time.monotonic()
+        self._changed = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    @property
+    def running(self):
+        return not self._task.done()
+
+    def poke(self, *, activity=False):
+        if activity:
+            self.last_activity = time.monotonic()
+        self._changed.set()
+
+    def stop(self):
+        self._task.cancel()
+
+    async def _run(self):
+        last_edit = time.monotonic()
+        content = None
+        while self.player.connected:
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=LIVE_EDIT_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            await asyncio.sleep(max(LIVE_MIN_GAP - (time.monotonic() - last_edit), 0.0))
+            self._changed.clear()
+
+            if time.monotonic() - self.last_activity > LIVE_IDLE:
+                content = (content or "").split("\n")[0] + "\n*stopped updating*"
+                await self._edit(content)
+                return
+
+            if (new := render_nowplaying(self.player)) != content:
+                content = new
+                last_edit = time.monotonic()
+                if not await self._edit(content):
+                    return
+
+    async def _edit(self, content):
+        try:
+            await self.message.edit(content=content)
+        except discord.NotFound:
+            return False
+        except discord.HTTPException as exc:
+            LOGGER.warning(f"editing live now playing in {self.message.channel.id} failed", exc_info=exc)
+        return True
+
+class CompactTrack:
+    """what the queue holds instead of a Playable
+    only the encoded track and what the queue page/snapshots need, turned back into a Playable when its played
+    """
+    __slots__ = ("encoded", "identifier", "title", "author", "uri", "length", "source", "is_stream", "is_seekable")
+
+    def __init__(self, track):
+        self.encoded = track.encoded
+        self.identifier = track.identifier
+        self.title = track.title
+        self.author = track.author
+        self.uri = track.uri
+        self.length = track.length
+        self.source = track.source
+        self.is_stream = track.is_stream
+        self.is_seekable = track.is_seekable
+
+    def to_playable(self):
+        return wavelink.Playable({
+            "encoded": self.encoded,
+            "info": {
+                "identifier": self.identifier,
+                "isSeekable": self.is_seekable,
+                "author": self.author,
+                "length": self.length,
+                "isStream": self.is_stream,
+                "position": 0,
+                "title": self.title,
+                "uri": self.uri,
+                "sourceName": self.source,
+            },
+            "pluginInfo": {},
+        })
+
+    def __eq__(self, other):
+        if isinstance(other, (CompactTrack, wavelink.Playable)):
+            return self.encoded == other.encoded
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.encoded)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} source={self.source} title={self.title!r}>"
+
+class CompactQueue(wavelink.Queue):
+    """wavelink queue that stores CompactTrack and hands out Playable from get()"""
+    def __init__(self, *, history=True):
+        super().__init__(history=False)
+        self._history = CompactQueue(history=False) if history else None
+
+    @staticmethod
+    def _check_compatibility(item):
+        if not isinstance(item, (wavelink.Playable, CompactTrack)):
+            raise TypeError("This queue is restricted to Playable objects.")
+        return True
+
+    @staticmethod
+    def _compact(item):
+        return CompactTrack(item) if isinstance(item, wavelink.Playable) else item
+
+    def get(self):
+        track = super().get()
+        if isinstance(track, CompactTrack):
+            self._loaded = track = track.to_playable()
+        return track
+
+    def put(self, item, /, *, atomic=True):
+        if isinstance(item, wavelink.Playable):
+            item = CompactTrack(item)
+        elif isinstance(item, Iterable):
+            # Playlist goes through here too
+            item = [self._compact(track) for track in item]
+        return super().put(item, atomic=atomic)
+
+    def put_at(self, index, value, /):
+        super().put_at(index, self._compact(value))
+
+    def extend(self, tracks):
+        """bulk put without any per-item type checks"""
+        before = len(self._items)
+        self._items.extend(map(self._compact, tracks))
+        self._wakeup_next()
+        return len(self._items) - before
+
 class nanika_bot_music_player(wavelink.Player):
+    def __init__(self, *args, **kwargs):
+        # channel.connect() doesnt let me pass nodes so pick it here
+        if "nodes" not in kwargs and (node := pick_node()):
+            kwargs["nodes"] = [node]
+        super().__init__(*args, **kwargs)
+        self.queue = CompactQueue()
+        # encoded track that the look-ahead already checked the next item for
+        self.looked_ahead_for = None
+        # perf_counter() of the last track finishing naturally, for the gap metric
+        self.finished_at = None
+        # monotonic() of when the reaper first saw this player idle
+        self.idle_since = None
+
     def cycle_queue_loop(self):
         rotation = [
             wavelink.QueueMode.loop,
@@ -161,15 +434,396 @@ class nanika_bot_music_player(wavelink.Player):
         index = rotation.index(self.queue.mode)
         self.queue.mode = rotation[(index + 1) % len(rotation)]
 
+    def idle_reason(self):
+        """why this player isnt doing anything useful, None if it is"""
+        if not any(not member.bot for member in self.channel.members):
+            return "alone"
+        if not self.current:
+            return "empty"
+        if self.paused:
+            return "paused"
+        return None
+
+    def snapshot(self):
+        """music_players row for this player, or None if theres nothing worth saving"""
+        current = self.current
+        queue = [track.encoded for track in self.queue]
+        if not current and not queue:
+            return None
+        return (
+            self.guild.id,
+            self.channel.id,
+            current and current.encoded,
+            queue,
+            self.queue.mode.name,
+            int(self.position),
+            self.paused,
+        )
+
 
 class Music(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.view = AudioPlayerView(self)
         bot.add_view(self.view)
+        # (normalised query, source) -> (cached_at, raw track payloads)
+        self._searches = utils.LRU(1024)
+        self._refreshing = set()
+        # guild ids that have a music_players row written by this process
+        self._snapshotted = set()
+        self._restoring = set()
+        self._restore_lock = asyncio.Lock()
+        self.idle_timeout = core.configs["lavalink"].get("idle_timeout", 300.0)
+        # guild id -> LiveNowPlaying
+        self.live = {}
+        # normalised query -> choices, shared by everyone typing
+        self._suggestions = utils.LRU(2048)
+        # user id -> (latest autocomplete interaction id, search task)
+        self._suggesting = {}
+
+    async def cog_load(self):
+        self.prune_search_cache.start()
+        self.prune_parked.start()
+        self.snapshot_players.start()
+        self.poll_nodes.start()
+        self.reap_players.start()
+        if any(node.status is wavelink.NodeStatus.CONNECTED for node in wavelink.Pool.nodes.values()):
+            # reloading the cog, node_ready already happened
+            self.schedule_restore()
 
-    def cog_unload(self):
+    async def cog_unload(self):
         self.view.stop()
+        self.prune_search_cache.cancel()
+        self.prune_parked.cancel()
+        self.snapshot_players.cancel()
+        self.poll_nodes.cancel()
+        self.reap_players.cancel()
+        for live in self.live.values():
+            live.stop()
+        for task in self._restoring:
+            task.cancel()
+        # bot.close() unloads cogs before leaving voice so this is the freshest state for a restart
+        await self.save_players()
+
+    UPSERT_PLAYER = """
+        INSERT INTO music_players (guild_id, channel_id, current, queue, mode, position, paused)
+        VALUES ($1, $2, $3, $4, $5, $6, $7)
+        ON CONFLICT (guild_id)
+        DO UPDATE SET channel_id=EXCLUDED.channel_id, current=EXCLUDED.current, queue=EXCLUDED.queue,
+                      mode=EXCLUDED.mode, position=EXCLUDED.position, paused=EXCLUDED.paused,
+                      saved_at=now()"""
+
+    async def save_players(self):
+        rows = [
+            row for player in self.bot.voice_clients
+            if isinstance(player, nanika_bot_music_player) and player.channel
+            if (row := player.snapshot())
+        ]
+        saved = {row[0] for row in rows}
+        async with self.bot.pgpool.acquire() as c, c.transaction():
+            if rows:
+                await c.executemany(self.UPSERT_PLAYER, rows)
+            if gone := self._snapshotted - saved:
+                await c.execute("DELETE FROM music_players WHERE guild_id=any($1::bigint[])", list(gone))
+        self._snapshotted = saved
+
+    async def forget_player(self, guild_id):
+        self._snapshotted.discard(guild_id)
+        await self.bot.pgpool.execute("DELETE FROM music_players WHERE guild_id=$1", guild_id)
+
+    @tasks.loop(seconds=30.0)
+    async def snapshot_players(self):
+        try:
+            await self.save_players()
+        except Exception as exc:
+            LOGGER.error("snapshotting players failed", exc_info=exc)
+
+    def schedule_restore(self, *, lost=None):
+        task = asyncio.create_task(self.restore_players(lost=lost))
+        self._restoring.add(task)
+        task.add_done_callback(self._restoring.discard)
+
+    async def restore_players(self, *, lost=None):
+        """bring back players from music_players
+        lost is a node that came back without its players, the ones discord.py still has on it are stale
+        players on any other node are left alone
+        """
+        await self.bot.wait_until_ready()
+        # one node coming back at a time
+        async with self._restore_lock:
+            await self._restore_players(lost)
+
+    async def _restore_players(self, lost):
+        records = await self.bot.pgpool.fetch("SELECT * FROM music_players")
+        failed = []
+        for record in records:
+            try:
+                restored = await self._restore_player(record, lost=lost)
+            except Exception as exc:
+                LOGGER.warning(f"couldnt restore player for guild {record['guild_id']}", exc_info=exc)
+                restored = False
+            if restored:
+                self._snapshotted.add(record["guild_id"])
+            else:
+                failed.append(record["guild_id"])
+
+        if failed:
+            await self.bot.pgpool.execute("DELETE FROM music_players WHERE guild_id=any($1::bigint[])", failed)
+        LOGGER.info(f"restored {len(records) - len(failed)}/{len(records)} players")
+
+    async def _restore_player(self, record, *, lost):
+        guild = self.bot.get_guild(record["guild_id"])
+        channel = guild and guild.get_channel(record["channel_id"])
+        if not channel:
+            return False
+
+        if player := guild.voice_client:
+            if lost is None or player.node is not lost:
+                return True
+            await player.disconnect(force=True)
+
+        encoded = ([record["current"]] if record["current"] else []) + record["queue"]
+        node = pick_node() or wavelink.Pool.get_node()
+        payloads = await node.send("POST", path="v4/decodetracks", data=encoded)
+        tracks = [wavelink.Playable(data) for data in payloads]
+
+        player = await channel.connect(cls=nanika_bot_music_player, self_deaf=True)
+        player.queue.mode = wavelink.QueueMode[record["mode"]]
+        if record["current"]:
+            current, *tracks = tracks
+        else:
+            current = tracks.pop(0)
+        player.queue.extend(tracks)
+
+        await player.play(current, start=record["position"] if record["current"] else 0, paused=record["paused"])
+        return True
+
+    @tasks.loop(seconds=30.0)
+    async def reap_players(self):
+        now = time.monotonic()
+        for player in list(self.bot.voice_clients):
+            if not isinstance(player, nanika_bot_music_player) or not player.channel:
+                continue
+            reason = player.idle_reason()
+            if reason is None:
+                player.idle_since = None
+                continue
+            if player.idle_since is None:
+                player.idle_since = now
+            if now - player.idle_since < self.idle_timeout:
+                continue
+            try:
+                await self.reap(player, reason)
+            except Exception as exc:
+                LOGGER.error(f"reaping player {player.guild.id} failed", exc_info=exc)
+
+    async def reap(self, player, reason):
+        """disconnect an idle player, parking its tracks so the next play can offer them back"""
+        guild_id = player.guild.id
+        tracks = []
+        if row := player.snapshot():
+            _, _, current, queue, *_ = row
+            tracks = ([current] if current else []) + queue
+        await player.disconnect()
+
+        if tracks:
+            await self.bot.pgpool.execute("""
+                INSERT INTO music_parked (guild_id, tracks) VALUES ($1, $2)
+                ON CONFLICT (guild_id) DO UPDATE SET tracks=EXCLUDED.tracks, parked_at=now()
+                """,
+                guild_id, tracks
+            )
+        await self.forget_player(guild_id)
+
+        self.bot.metrics[f"music:reaped:{reason}"].add()
+        self.bot.metrics["music:reaped_tracks"].add(len(tracks))
+        LOGGER.info(f"reaped {reason} player in guild {guild_id}, parked {len(tracks)} tracks")
+
+    @tasks.loop(hours=6)
+    async def prune_parked(self):
+        # guilds that never play again would keep theirs forever otherwise
+        await self.bot.pgpool.execute(
+            "DELETE FROM music_parked WHERE parked_at < now() - $1::interval",
+            PARKED_EXPIRE
+        )
+
+    async def offer_parked(self, ctx, player):
+        record = await self.bot.pgpool.fetchrow(
+            "DELETE FROM music_parked WHERE guild_id=$1 RETURNING tracks, parked_at",
+            ctx.guild.id
+        )
+        if not record or discord.utils.utcnow() - record["parked_at"] > PARKED_EXPIRE:
+            return
+
+        prompt = ConfirmationPrompt()
+        await ctx.send(
+            f"i left earlier with {len(record['tracks'])} tracks queued, add them back?",
+            view=prompt,
+            ephemeral=True
+        )
+        await prompt.wait()
+        if not prompt.result or not player.connected:
+            return
+
+        payloads = await player.node.send("POST", path="v4/decodetracks", data=record["tracks"])
+        player.queue.extend(wavelink.Playable(data) for data in payloads)
+        if not player.current:
+            await player.play(player.queue.get())
+
+    async def _offer_parked(self, ctx, player):
+        try:
+            await self.offer_parked(ctx, player)
+        except Exception as exc:
+            LOGGER.error(f"offering parked tracks in guild {ctx.guild.id} failed", exc_info=exc)
+
+    @tasks.loop(seconds=30.0)
+    async def poll_nodes(self):
+        # /v4/stats instead of the stats event since the event doesnt say which node its from
+        for node in wavelink.Pool.nodes.values():
+            if node.status is not wavelink.NodeStatus.CONNECTED:
+                continue
+            try:
+                node.nanika_stats = await node.fetch_stats()
+                node.nanika_stats_failed = False
+            except Exception as exc:
+                LOGGER.warning(f"couldnt get stats for node {node.identifier}", exc_info=exc)
+                node.nanika_stats = None
+                node.nanika_stats_failed = True
+
+        for node in wavelink.Pool.nodes.values():
+            if node_is_healthy(node) or not node.players:
+                continue
+            for player in list(node.players.values()):
+                if not (target := pick_node(exclude=node)):
+                    # nowhere healthy to move these to, carry on with the other nodes
+                    break
+                LOGGER.info(f"moving player {player.guild.id} from node {node.identifier} to {target.identifier}")
+                try:
+                    await player.switch_node(target)
+                except Exception as exc:
+                    LOGGER.error(f"moving player {player.guild.id} failed", exc_info=exc)
+                else:
+                    self.bot.metrics[f"music:node_migration:{node.identifier}"].add()
+
+    @core.command(name="nodes")
+    @commands.is_owner()
+    async def lavalink_nodes(self, ctx):
+        """show lavalink node health and load"""
+        rows = []
+        for node in wavelink.Pool.nodes.values():
+            stats = getattr(node, "nanika_stats", None)
+            frames = stats and stats.frames
+            rows.append([
+                node.identifier,
+                node.status.name,
+                "yes" if node_is_healthy(node) else "no",
+                len(node.players),
+                stats.playing if stats else "?",
+                f"{stats.cpu.system_load:.0%}" if stats else "?",
+                f"{stats.cpu.lavalink_load:.0%}" if stats else "?",
+                f"{frames.deficit}/{frames.nulled}" if frames else "-",
+                f"{node_penalty(node):.1f}",
+            ])
+        headers = ["node", "status", "healthy", "players", "playing", "cpu", "lavalink cpu", "deficit/nulled", "penalty"]
+        await ctx.safe_send_codeblock(tabulate.tabulate(rows, headers, tablefmt="psql"))
+
+    @commands.Cog.listener()
+    async def on_wavelink_node_ready(self, payload):
+        if not payload.resumed:
+            # on start up there are no players yet so this just restores everything
+            self.schedule_restore(lost=payload.node)
+
+    async def search(self, query, *, source=None):
+        """wavelink search that goes through an in-memory LRU then postgres before lavalink
+        playlists are passed straight through and never cached
+        """
+        started = time.perf_counter()
+        key = (normalise_query(query), source or "")
+        now = discord.utils.utcnow()
+
+        tier = "memory"
+        try:
+            entry = self._searches[key]
+        except KeyError:
+            entry = None
+        else:
+            if now - entry[0] >= SEARCH_EXPIRE:
+                # too old to serve even while it refreshes
+                del self._searches[key]
+                entry = None
+        if entry is None:
+            tier = "db"
+            record = await self.bot.pgpool.fetchrow(
+                "SELECT tracks, cached_at FROM music_search_cache WHERE query=$1 AND source=$2",
+                *key
+            )
+            if record and now - record["cached_at"] < SEARCH_EXPIRE:
+                self._searches[key] = entry = (record["cached_at"], json.loads(record["tracks"]))
+
+        if entry is None:
+            found = await self._search_lavalink(key, query, source)
+            self.bot.metrics["music:search:lavalink"].add((time.perf_counter() - started) * 1000)
+            return found
+
+        cached_at, payloads = entry
+        if now - cached_at >= SEARCH_FRESH and key not in self._refreshing:
+            self._refreshing.add(key)
+            asyncio.create_task(self._refresh_search(key, query, source))
+
+        self.bot.metrics[f"music:search:{tier}"].add((time.perf_counter() - started) * 1000)
+        return [wavelink.Playable(data) for data in payloads]
+
+    async def match_local(self, query):
+        """file from the local library that matches well enough to skip searching"""
+        library = self.bot.get_cog("Library")
+        if not library or query.strip().startswith(("http://", "https://")):
+            return None
+        try:
+            return await library.match(query)
+        except Exception as exc:
+            LOGGER.warning(f"local library lookup for {query!r} failed", exc_info=exc)
+            return None
+
+    async def _search_lavalink(self, key, query, source):
+        kwargs = {"source": source} if source else {}
+        found = await wavelink.Playable.search(query, **kwargs)
+        if found and not isinstance(found, wavelink.Playlist):
+            payloads = [track.raw_data for track in found]
+            self._searches[key] = (discord.utils.utcnow(), payloads)
+            try:
+                await self.bot.pgpool.execute("""
+                    INSERT INTO music_search_cache (query, source, tracks) VALUES ($1, $2, $3::jsonb)
+                    ON CONFLICT (query, source)
+                    DO UPDATE SET tracks=EXCLUDED.tracks, cached_at=EXCLUDED.cached_at
+                    """,
+                    *key, json.dumps(payloads, separators=(",", ":"))
+                )
+            except Exception as exc:
+                # the search itself still worked
+                LOGGER.error("couldnt persist search result", exc_info=exc)
+        return found
+
+    async def _refresh_search(self, key, query, source):
+        try:
+            found = await self._search_lavalink(key, query, source)
+            if not found or isinstance(found, wavelink.Playlist):
+                # nothing cacheable comes back anymore, stop serving the old tracks
+                self._searches.pop(key, None)
+                await self.bot.pgpool.execute(
+                    "DELETE FROM music_search_cache WHERE query=$1 AND source=$2",
+                    *key
+                )
+        except Exception as exc:
+            LOGGER.warning(f"refreshing cached search {key!r} failed", exc_info=exc)
+        finally:
+            self._refreshing.discard(key)
+
+    @tasks.loop(hours=6)
+    async def prune_search_cache(self):
+        await self.bot.pgpool.execute(
+            "DELETE FROM music_search_cache WHERE cached_at < now() - $1::interval",
+            SEARCH_EXPIRE
+        )
 
     async def cog_check(self, ctx):
         return await commands.guild_only().predicate(ctx)
@@ -187,8 +841,11 @@ class Music(commands.Cog):
     @core.command()
     async def play(self, ctx, *, query):
         """play a track from youtube/bandcamp/soundcloud/w/e"""
-        async with ctx.typing(ephemeral=True):
-            found: wavelink.Search = await wavelink.Playable.search(query)
+        async with ctx.typing(ephemeral=True, delay=0.4):
+            if track := await self.match_local(query):
+                found = [track]
+            else:
+                found: wavelink.Search = await self.search(query)
 
         if isinstance(found, wavelink.Playlist):
             playlist = found
@@ -231,6 +888,106 @@ class Music(commands.Cog):
         await self.play_tracks(ctx, [track])
         await ctx.plain(f"queued {track.title}")
 
+    # player actions shared by the commands and the console buttons
+    # they return something to tell the user, or None when an acknowledgement is enough
+
+    async def cycle_loop(self, player):
+        player.cycle_queue_loop()
+        return LOOP_MESSAGES[player.queue.mode]
+
+    async def skip_track(self, player):
+        await player.skip(force=True)
+
+    async def shuffle_queue(self, player):
+        player.queue.shuffle()
+
+    async def leave(self, player):
+        guild_id = player.guild.id
+        await player.disconnect()
+        await self.forget_player(guild_id)
+
+    @app_commands.command(name="play")
+    @app_commands.guild_only()
+    async def play_slash(self, interaction, query: str):
+        """play a track from youtube/bandcamp/soundcloud/w/e"""
+        await self.view.invoke_audio_command("play", interaction=interaction, kwargs={"query": query})
+
+    @play_slash.autocomplete("query")
+    async def play_autocomplete(self, interaction, current):
+        started = time.perf_counter()
+        query = normalise_query(current)
+        if len(query) < 3:
+            return []
+        if query.startswith(("http://", "https://")):
+            return [app_commands.Choice(name=utils.shorten(current, width=100), value=current[:100])]
+
+        choices = self._suggestions.get(query)
+        if choices is None and len(narrowed := self._suggest_from_prefix(query)) >= 5:
+            # typing more of something already searched, filtering is good enough
+            choices = narrowed
+        if choices is not None:
+            self.bot.metrics["music:suggest:cached"].add((time.perf_counter() - started) * 1000)
+            return choices
+
+        user_id = interaction.user.id
+        _, superseded = self._suggesting.get(user_id, (None, None))
+        if superseded:
+            superseded.cancel()
+        self._suggesting[user_id] = (interaction.id, None)
+
+        await asyncio.sleep(SUGGEST_DEBOUNCE)
+        if self._suggesting.get(user_id, (None,))[0] != interaction.id:
+            # kept typing, the client only shows the newest response anyway
+            return []
+
+        task = asyncio.create_task(self._suggest(query))
+        self._suggesting[user_id] = (interaction.id, task)
+        # the budget counts from when discord sent the keystroke, not from when it got here
+        age = (discord.utils.utcnow() - interaction.created_at).total_seconds()
+        try:
+            choices = await asyncio.wait_for(asyncio.shield(task), timeout=max(SUGGEST_BUDGET - age, 0.0))
+        except asyncio.TimeoutError:
+            # the search keeps going so the next keystroke can use it, unless that keystroke cancels it
+            self.bot.metrics["music:suggest:late"].add()
+            return self._suggest_from_prefix(query)
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                # this handler itself is being cancelled
+                raise
+            # a newer keystroke cancelled the search
+            self.bot.metrics["music:suggest:late"].add()
+            return self._suggest_from_prefix(query)
+        except Exception as exc:
+            LOGGER.warning(f"autocomplete search for {query!r} failed", exc_info=exc)
+            return self._suggest_from_prefix(query)
+        finally:
+            if self._suggesting.get(user_id, (None,))[0] == interaction.id:
+                del self._suggesting[user_id]
+
+        self.bot.metrics["music:suggest:search"].add((time.perf_counter() - started) * 1000)
+        return choices
+
+    async def _suggest(self, query):
+        found = await wavelink.Playable.search(query)
+        if isinstance(found, wavelink.Playlist):
+            found = found.tracks
+        choices = []
+        for track in found[:25]:
+            name = f"{track.title} - {track.author}" if track.author else track.title
+            # values are capped at 100 characters, the uri is exact when it fits
+            value = track.uri if track.uri and len(track.uri) <= 100 else utils.shorten(track.title, width=100)
+            choices.append(app_commands.Choice(name=utils.shorten(name, width=100), value=value))
+        self._suggestions[query] = choices
+        return choices
+
+    def _suggest_from_prefix(self, query):
+        """whatever the longest already searched prefix found that still matches every word"""
+        words = query.split()
+        for end in range(len(query) - 1, 2, -1):
+            if (choices := self._suggestions.get(query[:end])) is not None:
+                return [c for c in choices if all(word in c.name.casefold() for word in words)]
+        return []
+
     @core.command()
     @requires_voice()
     async def loop(self, ctx, mode: Literal[".", "*", "-"] = None):
@@ -251,21 +1008,14 @@ class Music(commands.Cog):
             player.queue.mode = modes[mode]
             await ctx.react("\N{JOYSTICK}" + VS16)
         else:
-            player.cycle_queue_loop()
             # add a little extra info since ppl wont always know the rotation
-            messages = {
-                wavelink.QueueMode.loop:     "now looping current track",
-                wavelink.QueueMode.loop_all: "now looping the queue",
-                wavelink.QueueMode.normal:   "not looping"
-            }
-            await ctx.send(messages[player.queue.mode], delete_after=5.0)
+            await ctx.send(await self.cycle_loop(player), delete_after=5.0)
 
     @core.command()
     @requires_voice(and_track=True)
     async def skip(self, ctx):
         """skip the current song"""
-        player = ctx.guild.voice_client
-        await player.skip(force=True)
+        await self.skip_track(ctx.guild.voice_client)
         await ctx.react("\N{JOYSTICK}" + VS16)
 
     @core.command(name="jump", aliases=["seek"])
@@ -308,53 +1058,61 @@ class Music(commands.Cog):
     @core.command(aliases=["np"])
     @requires_voice(and_track=True)
     async def nowplaying(self, ctx):
-        """show current track progress"""
-        player: wavelink.Player = ctx.guild.voice_client
-        track = player.current
-        position = player.position
-        duration = track.length
-
-        def delta_time(ms):
-            minutes, seconds = divmod(ms / 1000.0, 60.0)
-            hours, minutes = divmod(minutes, 60.0)
-            seconds, minutes, hours = (
-                (int(seconds)), int(minutes), int(hours)
-            )
-            if hours != 0:
-                return f"{hours}:{minutes:02}:{seconds:02}"
-            return f"{minutes}:{seconds:02}"
-
-        gap, mark = ("─", "●")
-        width = 8
-        index = int((position / duration) * width)
-        progress_bar = (gap * (index - 1)) + mark + ((width - index) * gap)
-
-        hyperlink = f"[{discord.utils.escape_markdown(track.title)}]({track.uri})"
-        await ctx.plain(
-            f"{hyperlink}\n"
-            f"{delta_time(position)} {progress_bar} {delta_time(duration)}"
-        )
+        """show current track progress, kept up to date for a while"""
+        player = ctx.guild.voice_client
+        sent = await ctx.plain(render_nowplaying(player))
+
+        if live := self.live.pop(ctx.guild.id, None):
+            live.stop()
+        if sent and not sent.flags.ephemeral:
+            # edit through the channel, interaction tokens run out after 15 minutes
+            message = ctx.channel.get_partial_message(sent.id)
+            self.live[ctx.guild.id] = LiveNowPlaying(player, message)
+
+    def poke_live(self, guild_id, *, activity=False):
+        if live := self.live.get(guild_id):
+            if live.running:
+                live.poke(activity=activity)
+            else:
+                del self.live[guild_id]
+
+    async def cog_after_invoke(self, ctx):
+        if ctx.guild:
+            self.poke_live(ctx.guild.id, activity=True)
 
     @core.command()
     @requires_voice()
     async def shuffle(self, ctx):
         """shuffle the queue"""
-        player = ctx.guild.voice_client
-        player.queue.shuffle()
+        await self.shuffle_queue(ctx.guild.voice_client)
         await ctx.react("\N{JOYSTICK}" + VS16)
 
     @core.command()
     @requires_voice()
     async def disconnect(self, ctx):
         """make the bot leave the voice channel. resets the queue."""
-        player = ctx.guild.voice_client
-        await player.disconnect()
+        await self.leave(ctx.guild.voice_client)
         await ctx.react("\N{JOYSTICK}" + VS16)
 
     class TrackPageSource(navi.ListPageSource):
         def __init__(self, tracks):
+            # tracks can be the queue itself since it supports len() and slicing,
+            # so only the page being shown gets copied
             super().__init__(tracks, per_page=12)
 
+        # the queue keeps moving while the pages are open so the page count is worked out on every turn
+        @property
+        def max_pages(self):
+            return max(-(len(self.items) // -self.per_page), 1)
+
+        @max_pages.setter
+        def max_pages(self, value):
+            pass
+
+        def _slice(self):
+            self.index = min(self.index, self.max_pages - 1)
+            return super()._slice()
+
         def format_page(self, navi, tracks):
             offset = self.index * self.per_page
             fmt = "\n".join(
@@ -373,8 +1131,7 @@ class Music(commands.Cog):
         if not len(player.queue):
             raise VoiceError("queue is empty")
 
-        tracks = [t for t in player.queue]
-        navigator = navi.Navi(self.TrackPageSource(tracks))
+        navigator = navi.Navi(self.TrackPageSource(player.queue))
         await ctx.alway_ephemeral().paginate(navigator)
 
     @core.command()
@@ -405,16 +1162,17 @@ class Music(commands.Cog):
     async def play_tracks(self, ctx, tracks):
         player: wavelink.Player
         player = ctx.guild.voice_client
+        connected = False
         if not player or not player.channel:
             state = ctx.author.voice
             if not state or not state.channel:
                 raise VoiceError("join a voice channel")
             player = await state.channel.connect(cls=nanika_bot_music_player, self_deaf=True)
+            connected = True
 
         # its always a good idea to push to the queue
         # so looping behaviour works as expected
-        for track in tracks:
-            player.queue.put(track)
+        player.queue.extend(tracks)
 
         if not player.current:
             # play the next song
@@ -424,12 +1182,85 @@ class Music(commands.Cog):
             if player.queue.mode is wavelink.QueueMode.loop:
                 await player.skip(force=True)
 
+        if connected:
+            # in the background so the requested track isnt held up by the prompt
+            asyncio.create_task(self._offer_parked(ctx, player))
+
+    @commands.Cog.listener()
+    async def on_wavelink_player_update(self, payload):
+        # how far behind the node's clock we are when handling its events
+        self.bot.metrics["music:event_lag"].add(max(time.time() * 1000 - payload.time, 0.0))
+        player = payload.player
+        if not isinstance(player, nanika_bot_music_player) or not (track := player.current):
+            return
+        if track.length - payload.position <= LOOKAHEAD_MS and player.looked_ahead_for != track.encoded:
+            player.looked_ahead_for = track.encoded
+            asyncio.create_task(self.look_ahead(player))
+
+    @commands.Cog.listener()
+    async def on_wavelink_track_start(self, payload):
+        player = payload.player
+        if not isinstance(player, nanika_bot_music_player):
+            return
+        self.poke_live(player.guild.id)
+        if player.finished_at is not None:
+            self.bot.metrics["music:track_gap"].add((time.perf_counter() - player.finished_at) * 1000)
+            player.finished_at = None
+        if payload.track.length <= LOOKAHEAD_MS and player.looked_ahead_for != payload.track.encoded:
+            # too short for a player update to land in the window
+            player.looked_ahead_for = payload.track.encoded
+            asyncio.create_task(self.look_ahead(player))
+
+    async def look_ahead(self, player):
+        """make sure the next queued track still loads so a dead one is dropped now and not at the transition
+        lavalink v4 has no way to pre-buffer a track that isnt playing so checking is all that can be done
+        """
+        if player.queue.mode is wavelink.QueueMode.loop:
+            return
+
+        for _ in range(5):
+            try:
+                track = player.queue.peek(0)
+            except (wavelink.QueueEmpty, IndexError):
+                return
+            if not track.uri:
+                # nothing to load it by again, the encoded track isnt an identifier
+                return
+
+            started = time.perf_counter()
+            try:
+                result = await player.node.send(
+                    "GET", path="v4/loadtracks", params={"identifier": track.uri}
+                )
+            except Exception as exc:
+                LOGGER.warning(f"look-ahead for {track.uri} failed", exc_info=exc)
+                return
+            self.bot.metrics["music:lookahead"].add((time.perf_counter() - started) * 1000)
+
+            if result.get("loadType") not in ("error", "empty"):
+                return
+
+            # only drop it if it wasnt moved/skipped while waiting
+            try:
+                still_next = player.queue.peek(0) is track
+            except (wavelink.QueueEmpty, IndexError):
+                return
+            if not still_next:
+                return
+            player.queue.delete(0)
+            self.bot.metrics["music:lookahead_dropped"].add()
+            LOGGER.info(f"dropped unplayable track {track.uri} from queue in guild {player.guild.id}")
+
     @commands.Cog.listener()
     async def on_wavelink_track_end(self, payload):
         player = payload.player
         if not player or not player.connected:
             return
 
+        if payload.reason == "finished" and isinstance(player, nanika_bot_music_player):
+            player.finished_at = time.perf_counter()
+        self.poke_live(player.guild.id)
+
         try:
             track = player.queue.get()
         except wavelink.QueueEmpty:
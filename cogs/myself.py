@@ -75,6 +75,12 @@ class myself(core.nanika_cog):
             if not spec:
                 break
 
+    @core.command()
+    async def reloadftl(self, ctx):
+        """reload the fluent translation files"""
+        await self.bot.tree.translator.load_bundles()
+        await ctx.send(f"{ctx.command.qualified_name}: {len(self.bot.tree.translator.bundles)} locales")
+
     @core.command()
     async def sync(self, ctx, spec: Literal["*", "."]):
         """syncing command"""
@@ -125,15 +131,9 @@ class myself(core.nanika_cog):
             rows = [[str(v) for v in r.values()] for r in recordset]
 
             pretty = tabulate.tabulate(rows, headers, tablefmt="psql")
-            codeblock = f"```\n{pretty}```"
-        else:
-            codeblock = recordset # it wont get shortened to unbound pretty
-
-        if len(codeblock) < 2000:
-            await ctx.send(codeblock)
+            await ctx.safe_send_codeblock(pretty, filename="rows.txt")
         else:
-            stream = io.BytesIO(pretty.encode("utf-8"))
-            await ctx.send(file=discord.File(stream, "rows.txt"))
+            await ctx.send(recordset)
 
     @commands.group(invoke_without_command=True)
     async def sql(self, ctx, *, query: utils.Codeblock):
@@ -171,6 +171,19 @@ class myself(core.nanika_cog):
         await ctx.send(flags)
         await ctx.send_help(ctx.command.qualified_name)
 
+    @core.command()
+    async def metrics(self, ctx, *, prefix=""):
+        """show the bot's internal counters, optionally only ones starting with prefix"""
+        rows = [
+            [name, tally.count, f"{tally.mean:.3f}", f"{tally.peak:.3f}", f"{tally.total:.3f}"]
+            for name, tally in sorted(self.bot.metrics.items())
+            if name.startswith(prefix)
+        ]
+        if not rows:
+            return await ctx.send("nothing recorded")
+        pretty = tabulate.tabulate(rows, ["name", "count", "mean", "peak", "total"], tablefmt="psql")
+        await ctx.safe_send_codeblock(pretty)
+
     @core.command(name="raise")
     async def raise_(self, ctx):
         """a command that raises an error"""
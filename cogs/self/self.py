@@ -388,7 +388,8 @@ class SelfBase(core.nanika_cog):
             await ctx.send("default me" if not was_default else "?-?")
 
     async def send_payload(self, ctx, payload):
-        as_json = json.dumps(payload, indent=4)
+        # iterencode so big payloads are streamed out instead of built up as one string
+        as_json = json.JSONEncoder(indent=4).iterencode(payload)
         await ctx.safe_send_codeblock(utils.Codeblock(code=as_json, language="json"))
 
     @core.command()
@@ -1,25 +1,99 @@
 import asyncio
+import datetime
+import hashlib
 import io
-import os
-import pathlib
+import json
+import logging
+import time
+from typing import NamedTuple
 
 import discord
 from discord import app_commands
-from discord.ext import commands
-from PIL import Image, ImageDraw
+from discord.ext import commands, tasks
+from PIL import Image, ImageDraw, features
 
 import core
 import utils
+from utils.ocr import (
+    SETTINGS,
+    OcrPool,
+    TessError,
+    TessResult,
+    choose_language,
+    detect_script,
+    prepare,
+    run_tesseract,
+    scale_boxes
+)
+
+LOGGER = logging.getLogger(__name__)
+
+OCR_CACHE_EXPIRE = datetime.timedelta(days=30)
+
+# subcommand -> tesseract language, without one the model is picked per image
+LANGUAGES = {"jpn": "jpn", "eng": "eng", "both": "jpn+eng"}
+
+# overlays are capped to this on their longest side, plenty to check the boxes against
+OVERLAY_MAX_SIDE = 2048
+# small overlays stay lossless png as long as they come out under this many bytes
+OVERLAY_PNG_BYTES = 2 * 1024 * 1024
+OVERLAY_PNG_PIXELS = 1_000_000
+
+class Overlay(NamedTuple):
+    data: bytes
+    extension: str
+
+def render_overlay(data, boxes):
+    """original image with the word boxes drawn on, shrunk and encoded to something small enough to send"""
+    image = Image.open(io.BytesIO(data))
+    width, height = image.size
+    scale = min(1.0, OVERLAY_MAX_SIDE / max(width, height))
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    if image.format == "JPEG":
+        image.draft("RGB", size)
+    transparent = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+    image = image.convert("RGBA" if transparent else "RGB")
+    if image.size != size:
+        image = image.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+
+    # every outline goes on one mask which gets painted in a single paste
+    x_scale, y_scale = size[0] / width, size[1] / height
+    mask = Image.new("1", size)
+    draw = ImageDraw.Draw(mask)
+    for left, top, right, bottom in boxes:
+        draw.rectangle(
+            (round(left * x_scale), round(top * y_scale), round(right * x_scale), round(bottom * y_scale)),
+            outline=1, width=2
+        )
+    image.paste("#88F2A4", mask=mask)
+
+    buffer = io.BytesIO()
+    if size[0] * size[1] <= OVERLAY_PNG_PIXELS:
+        image.save(buffer, "png")
+        if buffer.tell() <= OVERLAY_PNG_BYTES:
+            return Overlay(buffer.getvalue(), "png")
+        buffer = io.BytesIO()
+    if features.check("webp"):
+        image.save(buffer, "webp", quality=80, method=4)
+        return Overlay(buffer.getvalue(), "webp")
+    if transparent:
+        image = Image.alpha_composite(Image.new("RGBA", size, "white"), image).convert("RGB")
+    image.save(buffer, "jpeg", quality=85)
+    return Overlay(buffer.getvalue(), "jpg")
+
+class Recognised(NamedTuple):
+    attachment: discord.Attachment
+    result: TessResult | None = None
+    overlay: Overlay | None = None
+    error: str | None = None
+
+    def overlay_file(self):
+        return discord.File(io.BytesIO(self.overlay.data), f"{self.attachment.filename}.{self.overlay.extension}")
 
 
 async def setup(bot):
     await bot.add_cog(Tesseract(bot))
 
-class Semy(asyncio.Semaphore):
-    @property
-    def waiting(self):
-        return sum(not w.cancelled() for w in (self._waiters or ()))
-
 class Tesseract(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
@@ -28,11 +102,49 @@ class Tesseract(commands.Cog):
             callback=self.tess_context_cmd_adapter
         )
         bot.tree.add_command(self.context_cmd)
-        self._processing = set()
-        self._semaphore = Semy(10) # put a concurrency limit just to be safe
+        # (sha256, language, settings) -> task everyone asking for that image right now waits on
+        self._inflight = {}
+        # put a concurrency limit just to be safe, shared out fairly
+        # matched to the worker count once the pool is up so nothing waits past the queue
+        self.scheduler = utils.FairScheduler(4, limit=50)
+        # (sha256, language, settings) -> ticket of the ocr job for it while it waits for a slot
+        self._queued = {}
+        config = core.configs.get("tesseract", {})
+        self.pool = OcrPool(
+            bot.metrics,
+            size=config.get("workers", 2),
+            max_jobs=config.get("max_jobs", 200),
+            languages=["jpn+eng", "jpn", "eng"]
+        )
+        # thresholding helps with photos of paper but can eat thin text on busy screenshots
+        self.binarise = config.get("binarise", False)
+        self.settings = SETTINGS + ("-otsu" if self.binarise else "")
+        self._starting = None
+        # (sha256, language, settings) -> TessResult
+        self._results = utils.LRU(256)
+        # (sha256, language, settings) -> Overlay, so asking about the same image again doesnt redraw it
+        self._overlays = utils.LRU(32)
+
+    async def cog_load(self):
+        self.prune_ocr_cache.start()
+        if self.pool.size > 0:
+            # loading the models takes a few seconds, the subprocess path covers until then
+            self._starting = asyncio.create_task(self._start_pool())
+
+    async def _start_pool(self):
+        try:
+            await self.pool.start()
+        except Exception as exc:
+            LOGGER.warning("ocr worker pool unavailable, using tesseract processes", exc_info=exc)
+        else:
+            self.scheduler.resize(self.pool.size)
 
     def cog_unload(self):
         self.bot.tree.remove_command(self.context_cmd.name, type=self.context_cmd.type)
+        if self._starting:
+            self._starting.cancel()
+        self.pool.close()
+        self.prune_ocr_cache.cancel()
 
     @app_commands.allow_contexts(guilds=True, dms=True, private_channels=True)
     @app_commands.allow_installs(guilds=True, users=True)
@@ -47,11 +159,11 @@ class Tesseract(commands.Cog):
     @commands.group(aliases=["tesseract", "ocr"])
     async def tess(self, ctx):
         """tesseract ocr
-        japanese and english only.
+        japanese and english only, picks which by itself unless you use a subcommand.
         """
         ctx.alway_ephemeral()
-        attachment = next(iter(ctx.message.attachments), None)
-        if not attachment:
+        attachments = ctx.message.attachments
+        if not attachments:
             ref = ctx.message.reference
             if ref and ref.message_id:
                 try:
@@ -61,7 +173,7 @@ class Tesseract(commands.Cog):
                 else:
                     if message.author == ctx.me:
                         return await ctx.send("sorry you cant use tesseract on my own messages")
-                    attachment = next(iter(message.attachments), None)
+                    attachments = message.attachments
             else:
                 try:
                     message = await anext(
@@ -74,9 +186,9 @@ class Tesseract(commands.Cog):
                         "couldnt find an attachment. put a message URL or to reply to a message with an attachment"
                     )
                 else:
-                    attachment = message.attachments[0]
+                    attachments = message.attachments
 
-            if not attachment:
+            if not attachments:
                 msg = (
                     "attach file to your command invocation"
                     if not ctx.interaction
@@ -85,109 +197,248 @@ class Tesseract(commands.Cog):
                 await ctx.reply(msg, mention_author=False)
                 return
 
+        # every image of an album, otherwise just the first file
+        attachments = [a for a in attachments if (a.content_type or "").startswith("image/")] or attachments[:1]
         limit = min((ctx.guild and ctx.guild.filesize_limit) or 8388608, 104857600)
-        if attachment.size >= limit:
+        attachments = [a for a in attachments if a.size < limit]
+        if not attachments:
             await ctx.reply("sorry this attachment is too big", mention_author=False)
             return
-        elif hash(attachment) in self._processing:
-            await ctx.reply("im already processing this attachment", mention_author=False)
-            return
 
-        async with ctx.typing():
-            try:
-                await asyncio.wait_for(self._semaphore.acquire(), timeout=5.0)
-            except asyncio.TimeoutError:
-                return await ctx.send("too many people are using this command atm, try again later")
+        if self.scheduler.full(len(attachments)):
+            return await ctx.send("too many people are using this command atm, try again later")
 
+        language = LANGUAGES.get(ctx.invoked_subcommand and ctx.invoked_subcommand.name, "auto")
+        owner = (ctx.author.id, ctx.guild and ctx.guild.id)
+        # cache keys of the images so far, for the queue position message
+        keys = []
+        async with ctx.typing(delay=0.4):
+            notice = asyncio.create_task(self.show_position(ctx, keys))
+            # each image is its own ticket so a big album still takes turns with everyone else
+            jobs = [
+                asyncio.create_task(self.recognise_attachment(attachment, language, owner, keys))
+                for attachment in attachments
+            ]
             try:
-                # tesseract can write to stdout (saves having to write/read from disk)
-                # but i dont know how to get it to work when i specify multiple parameters
-                # (i cant know when the boxes end and when the text starts)
+                if len(jobs) == 1:
+                    await self.send_single(ctx, await jobs[0])
+                else:
+                    self.bot.metrics["tess:batch"].add(len(jobs))
+                    await self.send_batch(ctx, attachments, jobs)
+            finally:
+                notice.cancel()
+                for job in jobs:
+                    job.cancel()
 
-                base = pathlib.Path("tess/")
-                base.mkdir(exist_ok=True)
-                name = os.urandom(16).hex()
-                tessfile = base / (name + ".txt")
-                boxfile = base / (name + ".box")
+    async def recognise_attachment(self, attachment, language, owner, keys):
+        data = await attachment.read()
+        key = await self.cache_key(data, language)
+        keys.append(key)
+        try:
+            result = await self.recognise(key, data, owner=owner, timeout=15.0)
+        except utils.QueueFull:
+            return Recognised(attachment, error="too many people are using this command atm, try again later")
+        except asyncio.TimeoutError:
+            return Recognised(attachment, error="it was taking too long")
+        except TessError:
+            return Recognised(attachment, error="something went wrong...")
+        if not result.text:
+            return Recognised(attachment, error="didnt find any text")
+        return Recognised(attachment, result, await self.overlay(key, data, result.boxes))
 
-                language = ctx.invoked_subcommand and ctx.invoked_subcommand.name or "jpn+eng"
+    async def send_single(self, ctx, job):
+        if job.error:
+            return await ctx.reply(job.error)
 
-                try:
-                    self._processing.add(hash(attachment))
-                    stream = io.BytesIO(await attachment.read())
-
-                    proc = await asyncio.create_subprocess_exec(
-                        "tesseract", *(
-                            "stdin",
-                            (base.resolve() / name).as_posix(),
-                            "--oem", "1",
-                            "--psm", "11",
-                            "-l", language,
-                            "-c", "tessedit_create_txt=1",
-                            "-c", "tessedit_create_boxfile=1"
-                        ),
-                        stdin=asyncio.subprocess.PIPE,
-                        stdout=asyncio.subprocess.PIPE,
-                        stderr=asyncio.subprocess.PIPE
-                    )
-                    try:
-                        await asyncio.wait_for(proc.communicate(stream.read()), timeout=15.0)
-                    except asyncio.TimeoutError:
-                        proc.kill()
-                        await ctx.reply("it was taking too long")
-                        return
-
-                    if proc.returncode != 0:
-                        await ctx.reply("something went wrong...")
-                        return
-
-                    files = []
-
-                    content = "\n".join(
-                        s for line in tessfile.read_text().splitlines()
-                        if (s := line.strip())
-                    )
-                    if not content:
-                        await ctx.reply("didnt find any text")
-                        return
-
-                    escaped = discord.utils.escape_markdown(content)
-                    if len(escaped) > 2000:
-                        files.append(discord.File(io.BytesIO(content.encode("utf-8")), attachment.filename + ".txt"))
-                        escaped = discord.utils.MISSING
-
-                    stream.seek(0)
-                    fp = await self.draw_boxes(stream, boxfile)
-                    files.append(discord.File(fp, attachment.filename + ".png"))
-                    await ctx.reply(
-                        escaped,
-                        files=files,
-                        allowed_mentions=discord.AllowedMentions.none(),
-                        suppress_embeds=True
+        files = []
+        escaped = discord.utils.escape_markdown(job.result.text)
+        if len(escaped) > 2000:
+            files.append(discord.File(io.BytesIO(job.result.text.encode("utf-8")), job.attachment.filename + ".txt"))
+            escaped = discord.utils.MISSING
+        files.append(job.overlay_file())
+        await ctx.reply(
+            escaped,
+            files=files,
+            allowed_mentions=discord.AllowedMentions.none(),
+            suppress_embeds=True
+        )
+
+    async def send_batch(self, ctx, attachments, jobs):
+        """sends each image as soon as its done, then all the text in one file if it didnt fit in the messages"""
+        texts = {}
+        overflowed = False
+        for next_done in asyncio.as_completed(jobs):
+            job = await next_done
+            number = attachments.index(job.attachment) + 1
+            header = f"**{number}/{len(attachments)}** {discord.utils.escape_markdown(job.attachment.filename)}"
+            if job.error:
+                await ctx.send(f"{header}: {job.error}")
+                continue
+
+            texts[number] = job.result.text
+            content = f"{header}\n{discord.utils.escape_markdown(job.result.text)}"
+            if len(content) > 2000:
+                overflowed = True
+                content = f"{header}: too long, its in the file at the end"
+            await ctx.send(
+                content,
+                file=job.overlay_file(),
+                allowed_mentions=discord.AllowedMentions.none(),
+                suppress_embeds=True
+            )
+
+        merged = "\n\n".join(f"--- {attachments[n - 1].filename} ---\n{texts[n]}" for n in sorted(texts))
+        if overflowed or len(merged) > 2000:
+            await ctx.reply(file=discord.File(io.BytesIO(merged.encode("utf-8")), "ocr.txt"))
+
+    def queue_positions(self, keys):
+        """where the ocr jobs for these images are in the queue, cache hits and running ones arent in it"""
+        positions = []
+        for key in keys:
+            ticket = self._queued.get(key)
+            position = ticket and self.scheduler.position(ticket)
+            if position is not None:
+                positions.append(position)
+        return sorted(positions)
+
+    async def show_position(self, ctx, keys):
+        """queue position message that keeps up as the queue moves, gone while none of the images are waiting"""
+        await asyncio.sleep(1.0) # not worth it if a slot frees up right away
+        message = None
+        shown = None
+        try:
+            while True:
+                positions = self.queue_positions(keys)
+                if not positions:
+                    text = None
+                elif len(positions) == 1:
+                    eta = self.scheduler.estimate(positions[0])
+                    text = f"youre #{positions[0] + 1} in the queue, should be about {eta:.0f}s"
+                else:
+                    eta = self.scheduler.estimate(positions[-1])
+                    text = (
+                        f"{len(positions)} of your images are in the queue, next one is #{positions[0] + 1},"
+                        f" all of them should be going in about {eta:.0f}s"
                     )
-                finally:
-                    self._processing.discard(hash(attachment))
-                    tessfile.unlink(missing_ok=True)
-                    boxfile.unlink(missing_ok=True)
-            finally:
-                self._semaphore.release()
-
-    @utils.in_executor()
-    def draw_boxes(self, stream, boxfile):
-        boxes = boxfile.read_text().splitlines()
-        image = Image.open(stream)
-        draw = ImageDraw.Draw(image)
-        for line in boxes:
-            left, bottom, right, top = [int(n) for n in line.split()[-5:-1]]
-            box = (
-                (left, image.height - top),
-                (right, image.height - bottom)
+                if text != shown:
+                    if text is None:
+                        await message.delete()
+                        message = None
+                    elif message is None:
+                        message = await ctx.send(text)
+                    else:
+                        await message.edit(content=text)
+                    shown = text
+                await asyncio.sleep(2.0)
+        except discord.HTTPException:
+            pass
+        finally:
+            if message is not None:
+                asyncio.create_task(message.delete())
+
+    async def cache_key(self, data, language):
+        """keyed by what the image is rather than where it came from"""
+        digest = await asyncio.to_thread(lambda: hashlib.sha256(data).digest())
+        return (digest, language, self.settings)
+
+    async def recognise(self, key, data, *, owner, timeout):
+        """ocr through an in-memory LRU then postgres, only a miss on both takes a turn in the queue"""
+        try:
+            result = self._results[key]
+        except KeyError:
+            pass
+        else:
+            self.bot.metrics["tess:cache:memory"].add()
+            return result
+
+        if task := self._inflight.get(key):
+            # same image already being done for someone else, share it
+            self.bot.metrics["tess:coalesced"].add()
+        else:
+            self._inflight[key] = task = asyncio.create_task(self._recognise(key, data, owner, timeout))
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # one requester giving up shouldnt cancel it for the rest
+        return await asyncio.shield(task)
+
+    async def _recognise(self, key, data, owner, timeout):
+        _, language, _ = key
+        record = await self.bot.pgpool.fetchrow(
+            "SELECT text, boxes, detected FROM ocr_cache WHERE digest=$1 AND language=$2 AND settings=$3",
+            *key
+        )
+        if record:
+            self._results[key] = result = TessResult(
+                record["text"], [tuple(box) for box in json.loads(record["boxes"])], record["detected"]
             )
-            draw.rectangle(box, outline="#88F2A4", width=2)
-        buffer = io.BytesIO()
-        image.save(buffer, "png")
-        buffer.seek(0)
-        return buffer
+            self.bot.metrics["tess:cache:db"].add()
+            return result
+
+        # raises QueueFull for everyone waiting on this image
+        ticket = self.scheduler.enqueue(*owner)
+        self._queued[key] = ticket
+        try:
+            async with ticket:
+                result = await self.ocr(data, language, timeout=timeout)
+        finally:
+            del self._queued[key]
+        self._results[key] = result
+        self.bot.metrics["tess:cache:miss"].add()
+        try:
+            await self.bot.pgpool.execute("""
+                INSERT INTO ocr_cache (digest, language, settings, text, boxes, detected)
+                VALUES ($1, $2, $3, $4, $5::jsonb, $6)
+                ON CONFLICT (digest, language, settings)
+                DO UPDATE SET text=EXCLUDED.text, boxes=EXCLUDED.boxes, detected=EXCLUDED.detected,
+                              cached_at=EXCLUDED.cached_at
+                """,
+                *key, result.text, json.dumps(result.boxes, separators=(",", ":")), result.language
+            )
+        except Exception as exc:
+            # the ocr itself still worked
+            LOGGER.error("couldnt persist ocr result", exc_info=exc)
+        return result
+
+    @tasks.loop(hours=24)
+    async def prune_ocr_cache(self):
+        await self.bot.pgpool.execute(
+            "DELETE FROM ocr_cache WHERE cached_at < now() - $1::interval",
+            OCR_CACHE_EXPIRE
+        )
+
+    async def ocr(self, data, language, *, timeout):
+        if self.pool.ready:
+            return await self.pool.run(data, language, binarise=self.binarise, timeout=timeout)
+
+        started = time.perf_counter()
+        try:
+            prepared, x_scale, y_scale, thumbnail = await asyncio.to_thread(
+                prepare, data, binarise=self.binarise, thumbnail=language == "auto"
+            )
+        except Exception as exc:
+            # not an image pillow can read
+            raise TessError(repr(exc)) from exc
+        self.bot.metrics["tess:preprocess"].add((time.perf_counter() - started) * 1000)
+        async with asyncio.timeout(timeout):
+            if language == "auto":
+                detecting = time.perf_counter()
+                chosen = choose_language(*(await detect_script(thumbnail) or (None, 0.0)))
+                self.bot.metrics["tess:detect"].add((time.perf_counter() - detecting) * 1000)
+            else:
+                chosen = language
+            result = await run_tesseract(prepared, chosen)
+        self.bot.metrics[f"tess:ocr:process:{language}:{chosen}"].add((time.perf_counter() - started) * 1000)
+        result = scale_boxes(result, x_scale, y_scale)
+        return result._replace(language=chosen) if language == "auto" else result
+
+    async def overlay(self, key, data, boxes):
+        try:
+            return self._overlays[key]
+        except KeyError:
+            pass
+        started = time.perf_counter()
+        self._overlays[key] = overlay = await asyncio.to_thread(render_overlay, data, boxes)
+        self.bot.metrics[f"tess:overlay:{overlay.extension}"].add((time.perf_counter() - started) * 1000)
+        return overlay
 
     @tess.command(name="jpn")
     async def tess_jpn(self, ctx):
@@ -196,3 +447,7 @@ class Tesseract(commands.Cog):
     @tess.command(name="eng")
     async def tess_eng(self, ctx):
         """english only"""
+
+    @tess.command(name="both")
+    async def tess_both(self, ctx):
+        """japanese and english together, slower"""
@@ -2,8 +2,9 @@ import json
 import logging
 import pathlib
 import re
+import time
 import traceback
-from collections import deque
+from collections import defaultdict, deque
 from functools import cached_property
 from math import inf
 
@@ -60,6 +61,10 @@ class nanika_bot(commands.Bot):
         self.default_prefixes = ["ww", "!", "?"]
         self.debug_prefix = "wa"
         self._BotBase__cogs = CaseInsensitiveDictionary()
+        # interactions have 3 seconds to be answered
+        self.defer_budget = configs["discord"].get("defer_budget", 2.0)
+        # "what:detail" -> utils.Tally, shown by the metrics command
+        self.metrics = defaultdict(utils.Tally)
 
     async def on_message_edit(self, before, after):
         if before.content != after.content:
@@ -86,6 +91,17 @@ class nanika_bot(commands.Bot):
     async def get_context(self, origin, *, cls=None):
         return await super().get_context(origin, cls=cls or nanika_ctx)
 
+    async def invoke(self, ctx):
+        try:
+            await super().invoke(ctx)
+        finally:
+            ctx.disarm_watchdog()
+
+    async def on_command_completion(self, ctx):
+        # hybrid commands dont go through invoke()
+        ctx.disarm_watchdog()
+        self.metrics[f"command:{ctx.command.qualified_name}"].add((time.perf_counter() - ctx.created) * 1000)
+
     @utils.remember(inf)
     async def remember_guild_prefixes(self, guild_id):
         query = "SELECT prefixes FROM bot_prefixes WHERE id=$1"
@@ -115,7 +131,11 @@ class nanika_bot(commands.Bot):
         )
         self.watcher.start()
 
-        nodes = [wavelink.Node(uri=configs["lavalink"]["url"], password=configs["lavalink"]["password"])]
+        lavalink = configs["lavalink"]
+        nodes = [
+            wavelink.Node(identifier=n.get("identifier"), uri=n["url"], password=n["password"])
+            for n in lavalink.get("nodes", [lavalink])
+        ]
         await wavelink.Pool.connect(nodes=nodes, client=self, cache_capacity=None)
 
         for path in base.iterdir():
@@ -167,6 +187,7 @@ class nanika_bot(commands.Bot):
             return [ac.AppCommand(data=c, state=self._connection) for c in data]
 
     async def on_command_error(self, ctx, error):
+        ctx.disarm_watchdog()
         if isinstance(error, (commands.CommandInvokeError, commands.ConversionError, commands.HybridCommandError)):
             LOGGER.error(f"Ignoring unknown exception in command {ctx.command.qualified_name}", exc_info=error)
 
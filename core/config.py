@@ -1,9 +1,11 @@
 import tomllib
-from typing import TypedDict
+from typing import NotRequired, TypedDict
 
 
 class Discord(TypedDict):
     token: str
+    # seconds before an unanswered interaction gets deferred automatically
+    defer_budget: NotRequired[float]
 
 class PostgreSQL(TypedDict):
     uri: str
@@ -17,9 +19,28 @@ class GitHub(TypedDict):
     repository: str
     branch: str
 
-class Lavalink(TypedDict):
+class LavalinkNode(TypedDict):
     url: str
     password: str
+    identifier: NotRequired[str]
+
+class Lavalink(TypedDict):
+    url: NotRequired[str]
+    password: NotRequired[str]
+    # [[lavalink.nodes]] tables, used instead of url/password when given
+    nodes: NotRequired[list[LavalinkNode]]
+    # seconds a player can sit idle, paused or alone before it gets disconnected
+    idle_timeout: NotRequired[float]
+    # music directory indexed for the local source, has to be the same path lavalink sees
+    library: NotRequired[str]
+
+class Tesseract(TypedDict):
+    # long lived ocr worker processes, 0 to always spawn tesseract per request
+    workers: NotRequired[int]
+    # jobs a worker does before it gets replaced
+    max_jobs: NotRequired[int]
+    # otsu threshold the grayscale image before ocr
+    binarise: NotRequired[bool]
 
 class fernet(TypedDict):
     secret: str
@@ -29,6 +50,8 @@ class Config(TypedDict):
     postgresql: PostgreSQL
     gelbooru: gelbooru
     github: GitHub
+    lavalink: Lavalink
+    tesseract: NotRequired[Tesseract]
     fernet: fernet
 
 with open("config.toml", "rb") as f:
@@ -1,16 +1,67 @@
 import asyncio
-import io
+import itertools
 import logging
+import time
+from collections.abc import Iterable
 from contextlib import contextmanager
+from functools import partial
 
 import discord
 from discord.ext.commands import Context as OriginalContext
 from discord.utils import MISSING
 
+import utils
+
 __all__ = ("nanika_ctx",)
 
 LOGGER = logging.getLogger(__name__)
 
+# iterables still going after this many bytes are gzipped unless told otherwise,
+# their full size cant be known before the upload starts
+STREAM_PEEK = 1024 * 1024
+
+class DelayedTyping:
+    def __init__(self, ctx, *, delay, ephemeral):
+        self.ctx = ctx
+        self.delay = delay
+        self.ephemeral = ephemeral
+        self._task = None
+        self._typing = False
+
+    async def __aenter__(self):
+        ctx = self.ctx
+        if ctx.interaction:
+            # the watchdog already knows how to defer without racing send()
+            # so just pull it in closer instead of deferring now
+            budget = min(ctx.interaction_age + self.delay, ctx.bot.defer_budget)
+            ctx.arm_watchdog(budget, ephemeral=self.ephemeral)
+        else:
+            self._task = asyncio.create_task(self._type_later())
+
+    async def _type_later(self):
+        await asyncio.sleep(self.delay)
+        self._typing = True
+        async with OriginalContext.typing(self.ctx):
+            await asyncio.Event().wait() # until cancelled by __aexit__
+
+    async def __aexit__(self, exc_type, exc, tb):
+        ctx = self.ctx
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            except discord.HTTPException as error:
+                LOGGER.warning("delayed typing failed", exc_info=error)
+        else:
+            self._typing = ctx._auto_defer is not None
+            # whatever runs after the block gets the usual budget again
+            ctx.arm_watchdog()
+
+        outcome = "sent" if self._typing else "saved"
+        ctx.bot.metrics[f"typing:{outcome}:{ctx.command_name}"].add()
+
 class nanika_ctx(OriginalContext):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -19,6 +70,69 @@ class nanika_ctx(OriginalContext):
         self._redirect = None
         self._dont_need_parsing = False
         self._debugging = False
+        self._watchdog = None
+        self._auto_defer = None
+        self._watchdog_ephemeral = MISSING
+        # true while the watchdog's placeholder is waiting for a followup
+        self.auto_deferred = False
+        self.created = time.perf_counter()
+
+    @classmethod
+    async def from_interaction(cls, interaction):
+        ctx = await super().from_interaction(interaction)
+        ctx.arm_watchdog()
+        return ctx
+
+    def arm_watchdog(self, budget=None, *, ephemeral=MISSING):
+        """defer the interaction automatically if nothing answered it within budget seconds
+        budget is counted from when the interaction was created, defaults to bot.defer_budget
+        """
+        self.disarm_watchdog()
+        if not self.interaction or self.interaction.response.is_done():
+            return
+
+        if budget is None:
+            budget = self.bot.defer_budget
+        self._watchdog_ephemeral = ephemeral
+        loop = asyncio.get_running_loop()
+        self._watchdog = loop.call_later(max(budget - self.interaction_age, 0.0), self._watchdog_fire)
+
+    @property
+    def interaction_age(self):
+        return (discord.utils.utcnow() - self.interaction.created_at).total_seconds()
+
+    def disarm_watchdog(self):
+        if self._watchdog is not None:
+            self._watchdog.cancel()
+            self._watchdog = None
+
+    def _watchdog_fire(self):
+        self._watchdog = None
+        if self.interaction.response.is_done():
+            return
+        self._auto_defer = t = asyncio.create_task(self._defer_for_watchdog())
+        t.add_done_callback(self.__auto_defer_error_handle)
+
+    async def _defer_for_watchdog(self):
+        interaction = self.interaction
+        try:
+            # thinking so the first followup replaces the placeholder for components too
+            ephemeral = self._watchdog_ephemeral
+            if ephemeral is MISSING:
+                ephemeral = self._alway_ephemeral
+            await interaction.response.defer(ephemeral=ephemeral, thinking=True)
+        except discord.InteractionResponded:
+            return
+        self.auto_deferred = True
+        self.bot.metrics[f"autodefer:{self.command_name}"].add(self.interaction_age * 1000)
+
+    @property
+    def command_name(self):
+        return self.command.qualified_name if self.command else "?"
+
+    def __auto_defer_error_handle(self, task):
+        if not task.cancelled() and (exc := task.exception()):
+            LOGGER.error("auto defer error", exc_info=exc)
 
     def purge(self, **kwargs):
         """purge that also work in DMs
@@ -74,15 +188,33 @@ class nanika_ctx(OriginalContext):
         self._debugging = True
         return self
 
-    def typing(self, *, ephemeral=MISSING):
+    async def defer(self, *, ephemeral=MISSING):
+        self.disarm_watchdog()
+        if self._auto_defer is not None:
+            # the watchdog already did it
+            await asyncio.wait([self._auto_defer])
+            return
+        if ephemeral is MISSING:
+            ephemeral = self._alway_ephemeral
+        await super().defer(ephemeral=ephemeral)
+
+    def typing(self, *, ephemeral=MISSING, delay=None):
+        """delay, if given, only starts typing/deferring if the block is still running after that many seconds"""
         if ephemeral is MISSING:
             ephemeral = self._alway_ephemeral
+        if delay is not None:
+            return DelayedTyping(self, delay=delay, ephemeral=ephemeral)
         return super().typing(ephemeral=ephemeral)
 
     async def send(self, *args, **kwargs):
         if self._redirect is not None:
             return await self._redirect.send(*args, **kwargs)
 
+        self.disarm_watchdog()
+        if self._auto_defer is not None:
+            # let the deferral land first so this becomes its followup
+            await asyncio.wait([self._auto_defer])
+
         kwargs.setdefault("ephemeral", self._alway_ephemeral)
         anon = kwargs.pop("anonymous", False)
 
@@ -99,6 +231,7 @@ class nanika_ctx(OriginalContext):
                 kwargs.setdefault("mention_author", False) # without ping
 
         sent = await super().send(*args, **kwargs)
+        self.auto_deferred = False
 
         if not anon:
             if self_cog := self.bot.get_cog("Self"):
@@ -126,23 +259,69 @@ class nanika_ctx(OriginalContext):
                 mention_author=False, maybe_reply=False
             )
 
-    async def safe_send_codeblock(self, codeblock, *, filename=None, language=""):
+    async def safe_send_codeblock(self, codeblock, *, filename=None, language="", compress=None):
+        """code can also be an iterable of strings (eg. json iterencode) so huge outputs never get joined
+        outputs too big for a message are streamed as a file, and gzip/zip compressed (compress="gzip"/"zip")
+        when they are over the attachment limit. compress=None picks gzip when the output is over it,
+        or for iterables when it could be (still going after STREAM_PEEK bytes)
+        """
         match codeblock:
-            case (code, code_language):
+            case utils.Codeblock(code, code_language):
                 language = language or code_language
-            case str():
-                code = codeblock
             case _:
-                raise TypeError("safe_send_codeblock() only can take (code, language) tuple or string")
-
-        code = code.replace(self.bot.http.token, "[omg]")
-        with_zws = code.replace("```", "``\u200b`")
-        discord_markdown = f"```{language}\n{with_zws}```"
-        if len(discord_markdown) > 2000:
-            stream = io.BytesIO(code.encode("utf-8"))
-            return await self.send(file=discord.File(stream, filename or f"code.{language or 'txt'}"))
+                code = codeblock
+
+        secret = self.bot.http.token
+        rewindable = True
+        if isinstance(code, str):
+            factory = partial(utils.chunk_string, code)
+            length = len(code)
+            size = utils.utf8_len(code)
+        elif isinstance(code, Iterable):
+            # peek just enough to know whether it fits in a message, and then whether it needs compressing
+            iterator = iter(code)
+            head = []
+            length = size = 0
+            # the iterator can only be consumed once past the head
+            rewindable = False
+            for chunk in iterator:
+                head.append(chunk)
+                length += len(chunk)
+                size += utils.utf8_len(chunk)
+                if length > 2000 and (compress is not None or size > STREAM_PEEK):
+                    break
+            else:
+                # all of it is in head so it can be replayed
+                rewindable = True
+                if length <= 2000:
+                    code = "".join(head)
+            factory = partial(itertools.chain, head, iterator)
         else:
-            return await self.plain(discord_markdown)
+            raise TypeError("safe_send_codeblock() only can take a Codeblock, string or iterable of strings")
+
+        if isinstance(code, str) and length <= 2000:
+            code = code.replace(secret, "[omg]")
+            with_zws = code.replace("```", "``\u200b`")
+            discord_markdown = f"```{language}\n{with_zws}```"
+            if len(discord_markdown) <= 2000:
+                return await self.plain(discord_markdown)
+
+        filename = filename or f"code.{language or 'txt'}"
+        limit = (self.guild and self.guild.filesize_limit) or 8388608
+        if compress is None and (size >= limit or not rewindable):
+            compress = "gzip"
+
+        def stream():
+            chunks = (c.encode("utf-8") for c in utils.scrub_chunks(factory(), secret, "[omg]"))
+            if compress == "gzip":
+                return utils.gzip_chunks(chunks)
+            elif compress == "zip":
+                return utils.zip_chunks(chunks, filename)
+            return chunks
+
+        if compress:
+            filename += ".gz" if compress == "gzip" else ".zip"
+        return await self.send(file=discord.File(utils.IterStream(stream, rewindable=rewindable), filename))
 
     async def paginate(self, navi):
         navi.owner_id = self.author.id
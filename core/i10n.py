@@ -1,17 +1,38 @@
+import asyncio
 import contextvars
+import hashlib
+import importlib.metadata
+import importlib.util
+import logging
+import marshal
+import os
 import pathlib
+import time
 
+import babel
 import discord
 from discord import app_commands
 from discord.app_commands import locale_str
+from fluent_compiler.builtins import BUILTINS
 from fluent_compiler.bundle import FluentBundle
+from fluent_compiler.compiler import _parse_resources, messages_to_module
 from fluent_compiler.resource import FtlResource
+from fluent_compiler.utils import TERM_SIGIL
 
 __all__ = ("translate", "nanika_bot_translator",)
 
+LOGGER = logging.getLogger(__name__)
+
 LOCALE = contextvars.ContextVar("LOCALE")
 nanika_bot = None
 
+CACHE_PATH = pathlib.Path("fluent_cache/")
+# marshal output is only valid for the same python and the same compiler
+CACHE_SALT = (
+    importlib.util.MAGIC_NUMBER
+    + importlib.metadata.version("fluent_compiler").encode()
+)
+
 def translate(string, locale=None, /, **params):
     locale = locale or LOCALE.get()
 
@@ -21,39 +42,167 @@ def translate(string, locale=None, /, **params):
         else (string, None)
     )
 
-    dpy_translator = nanika_bot.tree.translator
-    bundles = []
-    bundles.append(dpy_translator.bundles[locale])
-    bundles.append(dpy_translator.bundles[dpy_translator.native])
-
     id_ = message if pattern is None else pattern
-    initial, _, _ = id_.partition(".")
-    for bundle in bundles:
-        if bundle.has_message(initial):
-            translated, _ = bundle.format(id_, params)
-            if translated is not None:
-                return translated
+    fn = nanika_bot.tree.translator.resolve(locale, id_)
+    if fn is not None:
+        return fn(params, [])
 
     if pattern is None:
         raise ValueError(f'{locale!r} missing "{id_}"')
 
     return message
 
+def _digest(files, base):
+    h = hashlib.sha256(CACHE_SALT)
+    for f in files:
+        h.update(f.relative_to(base).as_posix().encode())
+        h.update(b"\0")
+        h.update(f.read_bytes())
+        h.update(b"\0")
+    return h.hexdigest()[:32]
+
+def _module_globals(locale):
+    # the globals compiled messages run in only depend on the locale and the functions,
+    # so compiling nothing gives the same namespace the cached code objects expect
+    babel_locale = babel.Locale.parse(locale.replace("-", "_"))
+    return messages_to_module({}, babel_locale, functions=BUILTINS.copy())[2]
+
+def _make_bundle(locale, codes, mapping, module_globals, errors):
+    for code in codes:
+        exec(code, module_globals)
+    bundle = FluentBundle.__new__(FluentBundle)
+    bundle.locale = locale
+    bundle._compiled_messages = {
+        key: module_globals[name]
+        for key, name in mapping.items()
+        if not key.startswith(TERM_SIGIL)
+    }
+    bundle._compilation_errors = errors
+    return bundle
+
+def _compile(locale, files):
+    """what compile_messages() does but keeping the code objects around so they can be marshalled"""
+    resources = [FtlResource.from_string(f.read_text(encoding="utf-8")) for f in files]
+    messages, errors = _parse_resources(resources)
+    babel_locale = babel.Locale.parse(locale.replace("-", "_"))
+    module, mapping, module_globals, compile_errors = messages_to_module(
+        messages, babel_locale, functions=BUILTINS.copy()
+    )
+    codes = [
+        compile(module_ast, getattr(module_ast.body[0], "filename", "<string>"), "exec")
+        for module_ast in module.as_multiple_module_ast()
+    ]
+    mapping = {str(k): v for k, v in mapping.items()}
+    return _make_bundle(locale, codes, mapping, module_globals, errors + compile_errors), codes, mapping
+
+def _load_cached(locale, digest):
+    try:
+        data = (CACHE_PATH / f"{locale}.{digest}.marshal").read_bytes()
+    except FileNotFoundError:
+        return None
+    try:
+        codes, mapping = marshal.loads(data)
+        return _make_bundle(locale, codes, mapping, _module_globals(locale), [])
+    except Exception as exc:
+        LOGGER.warning(f"ignoring broken fluent cache for {locale}", exc_info=exc)
+        return None
+
+def _store_cached(locale, digest, codes, mapping):
+    CACHE_PATH.mkdir(exist_ok=True)
+    for old in CACHE_PATH.glob(f"{locale}.*.marshal"):
+        old.unlink(missing_ok=True)
+    path = CACHE_PATH / f"{locale}.{digest}.marshal"
+    temp = path.with_suffix(".tmp")
+    temp.write_bytes(marshal.dumps((codes, mapping)))
+    os.replace(temp, path)
+
 class nanika_bot_translator(app_commands.Translator):
     def __init__(self, bot, *, filepath, native):
         global nanika_bot
         nanika_bot = self.bot = bot
         self.native = native
+        self.filepath = filepath
         self.bundles = {}
+        # (locale, message id) -> compiled message function, or None when neither bundle has it
+        self._resolved = {}
+        self._compiling = {}
+
+    async def load(self):
+        # called by tree.set_translator()
+        await self.load_bundles()
+
+    async def unload(self):
+        for task in self._compiling.values():
+            task.cancel()
 
-        for path in pathlib.Path(filepath).iterdir():
+    async def load_bundles(self):
+        """load every locale from the disk cache, compiling the ones that changed in a thread
+        only the native locale is waited on, the rest fall back to it until they are ready
+        """
+        started = time.perf_counter()
+        found = {}
+        for path in pathlib.Path(self.filepath).iterdir():
             if path.is_dir():
-                resources = []
-                for f in path.glob("**/*.ftl"):
-                    ftl = FtlResource.from_string(f.read_text(encoding="utf-8"))
-                    resources.append(ftl)
+                files = sorted(path.glob("**/*.ftl"))
+                found[discord.Locale(path.name)] = (path, files, _digest(files, path))
+
+        for locale in self.bundles.keys() - found.keys():
+            del self.bundles[locale]
+
+        hits = 0
+        for locale, (path, files, digest) in found.items():
+            bundle = await asyncio.to_thread(_load_cached, path.name, digest)
+            if bundle is not None:
+                hits += 1
+                self.bundles[locale] = bundle
+                continue
+
+            if task := self._compiling.pop(locale, None):
+                task.cancel()
+            self._compiling[locale] = asyncio.create_task(self._compile_locale(locale, path.name, files, digest))
+
+        self._resolved = {}
+        if native := self._compiling.get(self.native):
+            await asyncio.shield(native)
+
+        elapsed = time.perf_counter() - started
+        self.bot.metrics["i10n:load"].add(elapsed * 1000)
+        LOGGER.info(f"fluent bundles: {hits}/{len(found)} from cache, ready in {elapsed * 1000.0:.1f}ms")
+
+    async def _compile_locale(self, locale, name, files, digest):
+        started = time.perf_counter()
+        try:
+            bundle, codes, mapping = await asyncio.to_thread(_compile, name, files)
+            self.bundles[locale] = bundle
+            # anything resolved meanwhile fell back to native
+            self._resolved = {}
+            self.bot.metrics["i10n:compile"].add((time.perf_counter() - started) * 1000)
+            await asyncio.to_thread(_store_cached, name, digest, codes, mapping)
+        except Exception as exc:
+            LOGGER.error(f"compiling fluent bundle for {name} failed", exc_info=exc)
+        finally:
+            if self._compiling.get(locale) is asyncio.current_task():
+                del self._compiling[locale]
+
+    def resolve(self, locale, id_):
+        """find the compiled function for a message id, falling back to the native locale
+        the decision is cached until a bundle is (re)loaded
+        """
+        key = (locale, id_)
+        try:
+            return self._resolved[key]
+        except KeyError:
+            pass
+
+        fn = None
+        for bundle_locale in (locale, self.native):
+            bundle = self.bundles.get(bundle_locale)
+            # message functions are keyed by the full id including attributes
+            if bundle is not None and (fn := bundle._compiled_messages.get(id_)) is not None:
+                break
 
-                self.bundles[discord.Locale(path.name)] = FluentBundle(path.name, resources)
+        self._resolved[key] = fn
+        return fn
 
     async def translate(self, string, locale, ctx):
         try:
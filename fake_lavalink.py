@@ -0,0 +1,354 @@
+"""lavalink v4 stand-in for trying the music cog under load without java or youtube
+
+speaks enough of the REST + websocket protocol for wavelink, makes tracks up from the query
+and pretends to play them (no audio is sent anywhere) so track start/end events and player updates still happen
+
+$ python fake_lavalink.py --port 2333 --latency 50 --track-seconds 30
+
+special identifiers:
+  "error:..." -> loadType error, "empty:..." -> loadType empty
+  urls with "list=" in them -> playlist of --playlist-size tracks
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+import time
+
+from aiohttp import web
+
+LOGGER = logging.getLogger("fake_lavalink")
+
+SOURCES = {
+    "ytsearch": "youtube",
+    "ytmsearch": "youtube",
+    "scsearch": "soundcloud",
+}
+
+def make_track(identifier, title, *, seconds, source="youtube", uri=None):
+    info = {
+        "identifier": identifier,
+        "isSeekable": True,
+        "author": "fake lavalink",
+        "length": seconds * 1000,
+        "isStream": False,
+        "position": 0,
+        "title": title,
+        "uri": uri or f"https://example.invalid/{source}/{identifier}",
+        "artworkUrl": None,
+        "isrc": None,
+        "sourceName": source,
+    }
+    # not the real binary format, only this server has to read it back
+    encoded = base64.urlsafe_b64encode(json.dumps(info, separators=(",", ":")).encode()).decode()
+    return {"encoded": encoded, "info": info, "pluginInfo": {}, "userData": {}}
+
+def decode_track(encoded):
+    info = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+    return {"encoded": encoded, "info": info, "pluginInfo": {}, "userData": {}}
+
+
+class FakePlayer:
+    def __init__(self, session, guild_id):
+        self.session = session
+        self.guild_id = guild_id
+        self.track = None
+        self.paused = False
+        self.volume = 100
+        self.voice = {}
+        self.filters = {}
+        self._base = 0
+        self._since = time.monotonic()
+        self._end = None
+
+    @property
+    def position(self):
+        if not self.track or self.paused:
+            return self._base
+        elapsed = int((time.monotonic() - self._since) * 1000)
+        return min(self._base + elapsed, self.track["info"]["length"])
+
+    def _schedule_end(self):
+        if self._end:
+            self._end.cancel()
+            self._end = None
+        if self.track and not self.paused:
+            remaining = (self.track["info"]["length"] - self._base) / 1000.0
+            self._end = asyncio.get_running_loop().call_later(max(remaining, 0.0), self._finished)
+
+    def _finished(self):
+        self._end = None
+        track, self.track = self.track, None
+        self._base = 0
+        self.session.event("TrackEndEvent", self.guild_id, track=track, reason="finished")
+
+    async def update(self, body, *, no_replace):
+        if "track" in body or "encodedTrack" in body:
+            encoded = body["track"].get("encoded") if "track" in body else body["encodedTrack"]
+            if encoded is None:
+                if self.track:
+                    track, self.track = self.track, None
+                    self._schedule_end()
+                    self.session.event("TrackEndEvent", self.guild_id, track=track, reason="stopped")
+            elif not (no_replace and self.track):
+                new = decode_track(encoded)
+                if user_data := body.get("track", {}).get("userData"):
+                    new["userData"] = user_data
+                if self.track:
+                    self.session.event("TrackEndEvent", self.guild_id, track=self.track, reason="replaced")
+                self.track = new
+                self._base = 0
+                self._since = time.monotonic()
+                self.session.event("TrackStartEvent", self.guild_id, track=new)
+
+        if "paused" in body:
+            self._base = self.position
+            self._since = time.monotonic()
+            self.paused = body["paused"]
+        if "position" in body:
+            self._base = body["position"]
+            self._since = time.monotonic()
+        if "volume" in body:
+            self.volume = body["volume"]
+        if "voice" in body:
+            self.voice = body["voice"]
+        if "filters" in body:
+            self.filters = body["filters"]
+        self._schedule_end()
+
+    def state(self):
+        return {
+            "time": int(time.time() * 1000),
+            "position": self.position,
+            "connected": bool(self.voice),
+            "ping": 0,
+        }
+
+    def to_dict(self):
+        return {
+            "guildId": str(self.guild_id),
+            "track": self.track,
+            "volume": self.volume,
+            "paused": self.paused,
+            "state": self.state(),
+            "voice": self.voice,
+            "filters": self.filters,
+        }
+
+    def destroy(self):
+        if self._end:
+            self._end.cancel()
+
+
+class Session:
+    def __init__(self, server, ws):
+        self.server = server
+        self.ws = ws
+        self.id = os.urandom(8).hex()
+        self.players = {}
+
+    def send(self, payload):
+        if not self.ws.closed:
+            asyncio.create_task(self.ws.send_json(payload))
+
+    def event(self, type_, guild_id, **fields):
+        self.send({"op": "event", "type": type_, "guildId": str(guild_id), **fields})
+
+    def player(self, guild_id):
+        try:
+            return self.players[guild_id]
+        except KeyError:
+            self.players[guild_id] = player = FakePlayer(self, guild_id)
+            return player
+
+    async def pump(self, interval):
+        while not self.ws.closed:
+            await asyncio.sleep(interval)
+            for player in list(self.players.values()):
+                if player.track:
+                    self.send({"op": "playerUpdate", "guildId": str(player.guild_id), "state": player.state()})
+
+
+class FakeLavalink:
+    def __init__(self, args):
+        self.args = args
+        self.sessions = {}
+        self.started = time.monotonic()
+        self.app = web.Application(middlewares=[self.middleware])
+        self.app.add_routes([
+            web.get("/v4/websocket", self.websocket),
+            web.get("/v4/info", self.info),
+            web.get("/v4/stats", self.stats_route),
+            web.get("/v4/loadtracks", self.loadtracks),
+            web.get("/v4/decodetrack", self.decodetrack),
+            web.post("/v4/decodetracks", self.decodetracks),
+            web.patch("/v4/sessions/{session}", self.update_session),
+            web.get("/v4/sessions/{session}/players", self.get_players),
+            web.get("/v4/sessions/{session}/players/{guild}", self.get_player),
+            web.patch("/v4/sessions/{session}/players/{guild}", self.update_player),
+            web.delete("/v4/sessions/{session}/players/{guild}", self.destroy_player),
+        ])
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        if request.headers.get("Authorization") != self.args.password:
+            raise web.HTTPUnauthorized()
+        if self.args.latency:
+            await asyncio.sleep(self.args.latency / 1000.0)
+        return await handler(request)
+
+    async def websocket(self, request):
+        ws = web.WebSocketResponse(heartbeat=30.0)
+        await ws.prepare(request)
+        session = Session(self, ws)
+        self.sessions[session.id] = session
+        LOGGER.info(f"session {session.id} connected for user {request.headers.get('User-Id')}")
+        await ws.send_json({"op": "ready", "resumed": False, "sessionId": session.id})
+        tasks = [
+            asyncio.create_task(session.pump(self.args.update_interval)),
+            asyncio.create_task(self.push_stats(session)),
+        ]
+        try:
+            async for _ in ws:
+                pass # clients dont send anything over the websocket in v4
+        finally:
+            for task in tasks:
+                task.cancel()
+            for player in session.players.values():
+                player.destroy()
+            del self.sessions[session.id]
+            LOGGER.info(f"session {session.id} closed")
+        return ws
+
+    def session(self, request):
+        try:
+            return self.sessions[request.match_info["session"]]
+        except KeyError:
+            raise web.HTTPNotFound()
+
+    async def info(self, request):
+        return web.json_response({
+            "version": {"semver": "4.0.0-fake", "major": 4, "minor": 0, "patch": 0, "preRelease": "fake", "build": None},
+            "buildTime": 0,
+            "git": {"branch": "fake", "commit": "0000000", "commitTime": 0},
+            "jvm": "none",
+            "lavaplayer": "none",
+            "sourceManagers": sorted(set(SOURCES.values())),
+            "filters": [],
+            "plugins": [],
+        })
+
+    def stats(self):
+        players = [p for s in self.sessions.values() for p in s.players.values()]
+        return {
+            "players": len(players),
+            "playingPlayers": sum(1 for p in players if p.track and not p.paused),
+            "uptime": int((time.monotonic() - self.started) * 1000),
+            "memory": {"free": 0, "used": 0, "allocated": 0, "reservable": 0},
+            "cpu": {"cores": os.cpu_count() or 1, "systemLoad": 0.0, "lavalinkLoad": 0.0},
+        }
+
+    async def push_stats(self, session):
+        while not session.ws.closed:
+            await asyncio.sleep(60.0)
+            session.send({"op": "stats", **self.stats()})
+
+    async def stats_route(self, request):
+        return web.json_response(self.stats())
+
+    async def loadtracks(self, request):
+        identifier = request.query.get("identifier", "")
+        seconds = self.args.track_seconds
+        prefix, _, query = identifier.partition(":")
+
+        if prefix == "error":
+            return web.json_response({
+                "loadType": "error",
+                "data": {"message": "fake failure", "severity": "common", "cause": "fake_lavalink"}
+            })
+        if prefix == "empty" or not identifier:
+            return web.json_response({"loadType": "empty", "data": {}})
+
+        if prefix in SOURCES:
+            source = SOURCES[prefix]
+            digest = hashlib.sha1(query.encode()).hexdigest()
+            tracks = [
+                make_track(f"{digest[:8]}{n}", f"{query} ({n + 1})", seconds=seconds, source=source)
+                for n in range(self.args.search_results)
+            ]
+            return web.json_response({"loadType": "search", "data": tracks})
+
+        digest = hashlib.sha1(identifier.encode()).hexdigest()
+        if "list=" in identifier:
+            tracks = [
+                make_track(f"{digest[:8]}{n}", f"playlist track {n + 1}", seconds=seconds)
+                for n in range(self.args.playlist_size)
+            ]
+            return web.json_response({
+                "loadType": "playlist",
+                "data": {"info": {"name": f"fake playlist {digest[:6]}", "selectedTrack": -1}, "pluginInfo": {}, "tracks": tracks}
+            })
+
+        return web.json_response({
+            "loadType": "track",
+            "data": make_track(digest[:11], f"track {digest[:6]}", seconds=seconds, uri=identifier)
+        })
+
+    async def decodetrack(self, request):
+        return web.json_response(decode_track(request.query["encodedTrack"]))
+
+    async def decodetracks(self, request):
+        return web.json_response([decode_track(e) for e in await request.json()])
+
+    async def update_session(self, request):
+        self.session(request)
+        body = await request.json()
+        return web.json_response({"resuming": body.get("resuming", False), "timeout": body.get("timeout", 60)})
+
+    async def get_players(self, request):
+        session = self.session(request)
+        return web.json_response([p.to_dict() for p in session.players.values()])
+
+    async def get_player(self, request):
+        session = self.session(request)
+        try:
+            player = session.players[int(request.match_info["guild"])]
+        except KeyError:
+            raise web.HTTPNotFound()
+        return web.json_response(player.to_dict())
+
+    async def update_player(self, request):
+        session = self.session(request)
+        player = session.player(int(request.match_info["guild"]))
+        no_replace = request.query.get("noReplace", "false").lower() == "true"
+        await player.update(await request.json(), no_replace=no_replace)
+        return web.json_response(player.to_dict())
+
+    async def destroy_player(self, request):
+        session = self.session(request)
+        if player := session.players.pop(int(request.match_info["guild"]), None):
+            player.destroy()
+        return web.Response(status=204)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="fake lavalink v4 node")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2333)
+    parser.add_argument("--password", default="nanika")
+    parser.add_argument("--latency", type=float, default=0.0, help="ms added to every REST request")
+    parser.add_argument("--track-seconds", type=int, default=180)
+    parser.add_argument("--search-results", type=int, default=5)
+    parser.add_argument("--playlist-size", type=int, default=100)
+    parser.add_argument("--update-interval", type=float, default=5.0, help="seconds between playerUpdate ops")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="[{asctime}] [{levelname:<8}] {name}: {message}", style="{")
+    web.run_app(FakeLavalink(args).app, host=args.host, port=args.port, print=None)
+
+if __name__ == "__main__":
+    main()
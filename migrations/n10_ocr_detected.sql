@@ -0,0 +1,2 @@
+-- model the "auto" language picked for the image, null for the rest
+ALTER TABLE ocr_cache ADD COLUMN detected TEXT;
@@ -0,0 +1,11 @@
+CREATE TABLE music_search_cache (
+    query TEXT NOT NULL,
+    source TEXT NOT NULL,
+    PRIMARY KEY (query, source),
+
+    -- raw lavalink track payloads so they can be rebuilt without a round trip
+    tracks JSONB NOT NULL,
+    cached_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX music_search_cache_cached_at_idx ON music_search_cache (cached_at);
@@ -0,0 +1,13 @@
+CREATE TABLE music_players (
+    guild_id BIGINT PRIMARY KEY,
+    channel_id BIGINT NOT NULL,
+
+    -- lavalink encoded tracks, decoded again on restore
+    current TEXT,
+    queue TEXT[] NOT NULL DEFAULT '{}',
+
+    mode TEXT NOT NULL DEFAULT 'normal',
+    position INT NOT NULL DEFAULT 0,
+    paused BOOLEAN NOT NULL DEFAULT FALSE,
+    saved_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
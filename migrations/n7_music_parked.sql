@@ -0,0 +1,7 @@
+CREATE TABLE music_parked (
+    guild_id BIGINT PRIMARY KEY,
+
+    -- lavalink encoded tracks of a player the reaper disconnected, current track first
+    tracks TEXT[] NOT NULL,
+    parked_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
@@ -0,0 +1,22 @@
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE TABLE music_library (
+    path TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    artist TEXT,
+    album TEXT,
+    length INT, -- milliseconds, null when the file didnt say
+
+    -- to tell which files changed since the last scan
+    mtime DOUBLE PRECISION NOT NULL,
+    size BIGINT NOT NULL,
+
+    -- lavalink track payload, filled in the first time the file is played
+    track JSONB,
+
+    search TEXT GENERATED ALWAYS AS (
+        lower(title || ' ' || coalesce(artist, '') || ' ' || coalesce(album, ''))
+    ) STORED
+);
+
+CREATE INDEX music_library_search_idx ON music_library USING gin (search gin_trgm_ops);
@@ -0,0 +1,15 @@
+CREATE TABLE ocr_cache (
+    -- sha256 of the image bytes
+    digest BYTEA NOT NULL,
+    language TEXT NOT NULL,
+    -- engine flags/preprocessing that produced this, see utils.ocr.SETTINGS
+    settings TEXT NOT NULL,
+
+    text TEXT NOT NULL,
+    -- [[left, top, right, bottom], ...]
+    boxes JSONB NOT NULL,
+    cached_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (digest, language, settings)
+);
+
+CREATE INDEX ocr_cache_cached_at_idx ON ocr_cache (cached_at);
@@ -1,7 +1,11 @@
 import asyncio
 import contextvars
+import io
+import tempfile
 import time
 import typing
+import zipfile
+import zlib
 from collections import OrderedDict, deque
 from contextlib import asynccontextmanager
 from functools import partial, wraps
@@ -83,6 +87,137 @@ def in_executor():
     return decorator
 
 
+CHUNK_SIZE = 64 * 1024
+
+def chunk_string(s, /, size=CHUNK_SIZE):
+    for index in range(0, len(s), size):
+        yield s[index:index + size]
+
+def utf8_len(s, /):
+    """how many bytes s is as utf-8, without encoding it when its ascii"""
+    return len(s) if s.isascii() else len(s.encode("utf-8"))
+
+def scrub_chunks(chunks, secret, replacement):
+    """replace secret in a stream of strings without joining them
+    the last len(secret)-1 characters are held back each time in case a secret straddles two chunks
+    """
+    keep = len(secret) - 1
+    tail = ""
+    for chunk in chunks:
+        buffer = (tail + chunk).replace(secret, replacement)
+        if len(buffer) <= keep:
+            tail = buffer
+            continue
+        tail = buffer[len(buffer) - keep:]
+        yield buffer[:len(buffer) - keep]
+    if tail:
+        yield tail
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=31) # 31 = gzip container
+    for chunk in chunks:
+        if data := compressor.compress(chunk):
+            yield data
+    yield compressor.flush()
+
+class _Drain(io.RawIOBase):
+    def __init__(self):
+        super().__init__()
+        self.pending = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.pending += b
+        return len(b)
+
+    def take(self):
+        data = bytes(self.pending)
+        self.pending.clear()
+        return data
+
+def zip_chunks(chunks, name):
+    # zipfile writes data descriptors when it cant seek, so this stays streamable
+    drain = _Drain()
+    with zipfile.ZipFile(drain, mode="w", compression=zipfile.ZIP_DEFLATED) as archive:
+        with archive.open(name, mode="w", force_zip64=True) as member:
+            for chunk in chunks:
+                member.write(chunk)
+                if drain.pending:
+                    yield drain.take()
+    yield drain.take()
+
+class IterStream(io.RawIOBase):
+    """read-only file object over an iterable of bytes so uploads dont need the whole payload joined
+    factory is called again on seek(0), which is what discord.File does when a request is retried
+    a stream that isnt rewindable keeps what it already read in a spooled temp file to replay instead
+    """
+    def __init__(self, factory, *, rewindable=True):
+        super().__init__()
+        self._factory = factory
+        self._rewindable = rewindable
+        self._iterator = iter(factory())
+        self._leftover = b""
+        self._position = 0
+        self._record = None if rewindable else tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+        self._recorded = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        # only back to the start, but discord.File wont take it otherwise
+        return True
+
+    def readinto(self, b):
+        if self._record is not None:
+            return self._replay_into(b)
+        while not self._leftover:
+            try:
+                self._leftover = next(self._iterator)
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._leftover))
+        b[:n] = self._leftover[:n]
+        self._leftover = self._leftover[n:]
+        self._position += n
+        return n
+
+    def _replay_into(self, b):
+        while self._position >= self._recorded:
+            try:
+                chunk = next(self._iterator)
+            except StopIteration:
+                return 0
+            self._record.seek(0, io.SEEK_END)
+            self._record.write(chunk)
+            self._recorded += len(chunk)
+        self._record.seek(self._position)
+        n = self._record.readinto(memoryview(b)[:self._recorded - self._position])
+        self._position += n
+        return n
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR and offset == 0 or whence == io.SEEK_SET and offset == self._position:
+            return self._position
+        if whence == io.SEEK_SET and offset == 0:
+            if self._record is None:
+                self._iterator = iter(self._factory())
+                self._leftover = b""
+            self._position = 0
+            return 0
+        raise io.UnsupportedOperation("can only rewind to the start")
+
+    def close(self):
+        if self._record is not None:
+            self._record.close()
+        super().close()
+
+
 class BlankPaginator(Paginator):
     def __init__(self):
         super().__init__(prefix=None, suffix=None)
@@ -158,6 +293,143 @@ class BucketedLock:
         )
 
 
+class QueueFull(Exception):
+    pass
+
+class _Ticket:
+    __slots__ = ("scheduler", "user_id", "guild_id", "future", "started")
+
+    def __init__(self, scheduler, user_id, guild_id):
+        self.scheduler = scheduler
+        self.user_id = user_id
+        self.guild_id = guild_id
+        self.future = asyncio.get_running_loop().create_future()
+        self.started = None
+
+    async def __aenter__(self):
+        try:
+            await self.future
+        except asyncio.CancelledError:
+            self.scheduler._abandon(self)
+            raise
+        self.started = time.perf_counter()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.scheduler._finish(self)
+
+class FairScheduler:
+    """limits how many jobs run at once, handing free slots out round robin
+    over guilds and then over users in that guild, so one user (or one server) cant take every slot
+    """
+    def __init__(self, slots, *, limit):
+        self.slots = slots
+        self.limit = limit
+        self.running = 0
+        self.waiting = 0
+        # guild id -> user id -> tickets, both rotated as they get served
+        self._guilds = OrderedDict()
+        self._durations = deque(maxlen=50)
+
+    def enqueue(self, user_id, guild_id=None):
+        """ticket to use with async with, raises QueueFull when too many are waiting"""
+        if self.full():
+            raise QueueFull()
+        ticket = _Ticket(self, user_id, guild_id)
+        users = self._guilds.setdefault(guild_id, OrderedDict())
+        users.setdefault(user_id, deque()).append(ticket)
+        self.waiting += 1
+        self._dispatch()
+        return ticket
+
+    def full(self, count=1):
+        """whether count more tickets would go past the limit"""
+        return self.waiting + count > self.limit
+
+    def resize(self, slots):
+        """change how many jobs run at once, new slots are handed out right away"""
+        self.slots = slots
+        self._dispatch()
+
+    def _dispatch(self):
+        while self.running < self.slots and self.waiting:
+            guild_id, users = next(iter(self._guilds.items()))
+            user_id, tickets = next(iter(users.items()))
+            ticket = tickets.popleft()
+            if tickets:
+                users.move_to_end(user_id)
+            else:
+                del users[user_id]
+            if users:
+                self._guilds.move_to_end(guild_id)
+            else:
+                del self._guilds[guild_id]
+            self.waiting -= 1
+            if ticket.future.done():
+                # cancelled while waiting, its task hasnt run _abandon yet and will find it gone
+                continue
+            self.running += 1
+            ticket.future.set_result(None)
+
+    def _abandon(self, ticket):
+        if ticket.future.done() and not ticket.future.cancelled():
+            # got its slot just as it was cancelled
+            self.running -= 1
+            self._dispatch()
+            return
+        users = self._guilds.get(ticket.guild_id, {})
+        tickets = users.get(ticket.user_id, ())
+        if ticket not in tickets:
+            # _dispatch got to it first and already dropped it
+            return
+        tickets.remove(ticket)
+        if not tickets:
+            del users[ticket.user_id]
+        if not users:
+            del self._guilds[ticket.guild_id]
+        self.waiting -= 1
+
+    def _finish(self, ticket):
+        self.running -= 1
+        self._durations.append(time.perf_counter() - ticket.started)
+        self._dispatch()
+
+    def position(self, ticket):
+        """how many tickets will be served before this one, None if it isnt waiting"""
+        if ticket.future.done():
+            return None
+        # play the rotation forward on copies
+        guilds = deque(deque(deque(tickets) for tickets in users.values()) for users in self._guilds.values())
+        ahead = 0
+        while guilds:
+            users = guilds.popleft()
+            tickets = users.popleft()
+            if tickets.popleft() is ticket:
+                return ahead
+            ahead += 1
+            if tickets:
+                users.append(tickets)
+            if users:
+                guilds.append(users)
+        return None
+
+    @property
+    def mean_duration(self):
+        return sum(self._durations) / len(self._durations) if self._durations else 5.0
+
+    def estimate(self, position):
+        """rough seconds until a ticket this far back gets a slot"""
+        return self.mean_duration * (position // self.slots + 1)
+
+    def __repr__(self):
+        return (
+            f"<{self.__class__.__name__}"
+            f" running={self.running}/{self.slots}"
+            f" waiting={self.waiting}/{self.limit}"
+            ">"
+        )
+
+
 class LRU(OrderedDict):
     def __init__(self, maxsize=128):
         super().__init__()
@@ -174,6 +446,38 @@ class LRU(OrderedDict):
             self.popitem(last=False)
 
 
+class Tally:
+    """running count/mean/peak of some measurement
+    cheap enough to bump on hot paths, read back with the metrics command
+    durations always go in as milliseconds so every row can be compared
+    """
+    __slots__ = ("count", "total", "peak")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.peak = 0.0
+
+    def add(self, value=1.0):
+        self.count += 1
+        self.total += value
+        if value > self.peak:
+            self.peak = value
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def __repr__(self):
+        return (
+            f"<{self.__class__.__name__}"
+            f" count={self.count}"
+            f" mean={self.mean:.3f}"
+            f" peak={self.peak:.3f}"
+            ">"
+        )
+
+
 def remember(maxsize=128):
     """*only works on bound methods
     *uses string representation of each positional for the key
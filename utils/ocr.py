@@ -0,0 +1,451 @@
+"""tesseract plumbing kept out of the cog so worker processes dont have to import it"""
+import asyncio
+import io
+import logging
+import os
+import pickle
+import struct
+import sys
+import time
+from typing import NamedTuple
+
+from PIL import Image
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+LOGGER = logging.getLogger(__name__)
+
+# part of the ocr cache key, change it when anything that affects the output changes
+SETTINGS = "oem1-psm11-gray4mp-osd1mp"
+
+# images get shrunk to about this many pixels (a4 at ~200dpi) before ocr,
+# past that tesseract only gets slower and phone screenshots start getting read worse
+TARGET_PIXELS = 4_000_000
+
+# what tesseract's osd calls the scripts the jpn model reads
+JAPANESE_SCRIPTS = {"Japanese", "Han", "Hiragana", "Katakana"}
+# osd script confidence needed before trusting a single model with the image
+SCRIPT_CONFIDENCE = 2.0
+# osd only has to make out a few lines of glyphs, so it gets a copy shrunk to about this many pixels
+OSD_PIXELS = 1_000_000
+
+def choose_language(script, confidence):
+    """model for the "auto" language from what osd saw, jpn+eng whenever it isnt sure"""
+    if script is None or confidence < SCRIPT_CONFIDENCE:
+        return "jpn+eng"
+    if script == "Latin":
+        return "eng"
+    if script in JAPANESE_SCRIPTS:
+        return "jpn"
+    return "jpn+eng"
+
+class TessError(Exception):
+    pass
+
+class TessResult(NamedTuple):
+    text: str
+    # word boxes as (left, top, right, bottom), top-left origin
+    boxes: list[tuple[int, int, int, int]]
+    # the model that was picked when asked for "auto"
+    language: str | None = None
+
+class TsvParser:
+    """builds text lines and word boxes from tesseract's tsv output as it streams in"""
+    def __init__(self):
+        self._lines = []
+        self._line_key = None
+        self._words = []
+        self.boxes = []
+        self._header = True
+
+    def feed(self, raw):
+        if self._header:
+            # level page_num block_num par_num line_num word_num left top width height conf text
+            self._header = False
+            return
+        if isinstance(raw, bytes):
+            raw = raw.decode("utf-8", "replace")
+        fields = raw.rstrip("\r\n").split("\t", 11)
+        # only word rows (level 5) have text
+        if len(fields) < 12 or fields[0] != "5" or not (word := fields[11].strip()):
+            return
+        key = tuple(fields[1:5])
+        if key != self._line_key:
+            self._end_line()
+            self._line_key = key
+        self._words.append(word)
+        left, top, width, height = (int(n) for n in fields[6:10])
+        self.boxes.append((left, top, left + width, top + height))
+
+    def _end_line(self):
+        if self._words:
+            self._lines.append(" ".join(self._words))
+            self._words = []
+
+    def result(self):
+        self._end_line()
+        return TessResult("\n".join(self._lines), self.boxes)
+
+
+def _otsu(histogram):
+    # threshold that best splits the histogram into two classes
+    total = sum(histogram)
+    weighted = sum(value * count for value, count in enumerate(histogram))
+    below = below_weighted = 0
+    best = threshold = 0
+    for value, count in enumerate(histogram):
+        below += count
+        above = total - below
+        if not below:
+            continue
+        if not above:
+            break
+        below_weighted += value * count
+        spread = below * above * (below_weighted / below - (weighted - below_weighted) / above) ** 2
+        if spread > best:
+            best, threshold = spread, value
+    return threshold
+
+def preprocess(data, *, binarise=False):
+    """decodes once into a grayscale image small enough for tesseract
+    returns it with the x and y factors to scale its boxes back up to the original by
+    """
+    image = Image.open(io.BytesIO(data))
+    width, height = image.size
+    factor = min(1.0, (TARGET_PIXELS / (width * height)) ** 0.5)
+    target = (max(1, round(width * factor)), max(1, round(height * factor)))
+    if image.format == "JPEG":
+        # libjpeg can do most of the shrinking (and the grayscale) while decoding
+        image.draft("L", target)
+    if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info:
+        # transparent screenshots are often dark text on nothing, which is all black once the alpha is dropped
+        image = Image.alpha_composite(Image.new("RGBA", image.size, "white"), image.convert("RGBA"))
+    image = image.convert("L")
+    if image.size != target:
+        image = image.resize(target, Image.Resampling.LANCZOS, reducing_gap=2.0)
+    if binarise:
+        threshold = _otsu(image.histogram())
+        image = image.point([0] * (threshold + 1) + [255] * (255 - threshold))
+    return image, width / image.width, height / image.height
+
+def osd_thumbnail(image):
+    """smaller copy of a preprocessed image for the script detection pass"""
+    factor = (OSD_PIXELS / (image.width * image.height)) ** 0.5
+    if factor >= 1.0:
+        return image
+    size = (max(1, round(image.width * factor)), max(1, round(image.height * factor)))
+    return image.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+
+def _png(image):
+    buffer = io.BytesIO()
+    # tesseract decodes it again right away, no point spending time compressing
+    image.save(buffer, "png", compress_level=1)
+    return buffer.getvalue()
+
+def prepare(data, *, binarise=False, thumbnail=False):
+    """preprocess into png bytes for piping to a tesseract process
+    with thumbnail the osd_thumbnail of it comes back as png bytes too, otherwise None
+    """
+    image, x_scale, y_scale = preprocess(data, binarise=binarise)
+    return _png(image), x_scale, y_scale, _png(osd_thumbnail(image)) if thumbnail else None
+
+def scale_boxes(result, x_scale, y_scale):
+    if x_scale == y_scale == 1.0:
+        return result
+    return result._replace(boxes=[
+        (round(left * x_scale), round(top * y_scale), round(right * x_scale), round(bottom * y_scale))
+        for left, top, right, bottom in result.boxes
+    ])
+
+
+async def detect_script(data):
+    """(script, confidence) from a one-off tesseract osd process, None when there wasnt enough text to tell"""
+    proc = await asyncio.create_subprocess_exec(
+        "tesseract", "stdin", "stdout", "--psm", "0",
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL
+    )
+    try:
+        output, _ = await proc.communicate(data)
+    except BaseException:
+        if proc.returncode is None:
+            proc.kill()
+        raise
+    if proc.returncode != 0:
+        return None
+    fields = dict(line.partition(":")[::2] for line in output.decode("utf-8", "replace").splitlines())
+    try:
+        return fields["Script"].strip(), float(fields["Script confidence"])
+    except (KeyError, ValueError):
+        return None
+
+async def run_tesseract(data, language):
+    """one-off tesseract process with tsv on stdout, which has both the text and the word boxes"""
+    proc = await asyncio.create_subprocess_exec(
+        "tesseract", *(
+            "stdin", "stdout",
+            "--oem", "1",
+            "--psm", "11",
+            "-l", language,
+            "tsv"
+        ),
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL
+    )
+
+    async def feed():
+        try:
+            proc.stdin.write(data)
+            await proc.stdin.drain()
+        finally:
+            proc.stdin.close()
+
+    parser = TsvParser()
+    feeding = asyncio.create_task(feed())
+    try:
+        async for line in proc.stdout:
+            parser.feed(line)
+        await feeding
+        returncode = await proc.wait()
+    except BaseException:
+        feeding.cancel()
+        if proc.returncode is None:
+            proc.kill()
+        raise
+
+    if returncode != 0:
+        raise TessError(returncode)
+    return parser.result()
+
+
+# the tsv header GetTSVText leaves out
+TSV_HEADER = "level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext"
+
+# worker messages are pickles prefixed with their length
+HEADER = struct.Struct("!I")
+
+def _worker_main(languages):
+    # runs in the worker process, jobs come in on stdin and results go out on the original stdout
+    # (fd 1 is pointed at stderr so anything tesseract prints cant corrupt the stream)
+    incoming = sys.stdin.buffer
+    outgoing = os.fdopen(os.dup(1), "wb")
+    os.dup2(2, 1)
+
+    def send(message):
+        payload = pickle.dumps(message)
+        outgoing.write(HEADER.pack(len(payload)) + payload)
+        outgoing.flush()
+
+    apis = {}
+    def api_for(language):
+        try:
+            return apis[language]
+        except KeyError:
+            apis[language] = api = tesserocr.PyTessBaseAPI(
+                lang=language, oem=tesserocr.OEM.LSTM_ONLY, psm=tesserocr.PSM.SPARSE_TEXT
+            )
+            return api
+
+    def detect(image):
+        if osd is None:
+            return choose_language(None, 0.0)
+        osd.SetImage(image)
+        # None when there isnt enough text
+        found = osd.DetectOrientationScript() or {}
+        osd.Clear()
+        return choose_language(found.get("script_name"), found.get("script_conf", 0.0))
+
+    started = time.perf_counter()
+    for language in languages:
+        api_for(language)
+    try:
+        # legacy engine only
+        osd = tesserocr.PyTessBaseAPI(lang="osd", oem=tesserocr.OEM.DEFAULT, psm=tesserocr.PSM.OSD_ONLY)
+    except RuntimeError:
+        # osd.traineddata isnt installed, "auto" always ends up as jpn+eng
+        osd = None
+    send(("ready", time.perf_counter() - started, False))
+
+    while header := incoming.read(HEADER.size):
+        data, language, binarise = pickle.loads(incoming.read(HEADER.unpack(header)[0]))
+        try:
+            image, x_scale, y_scale = preprocess(data, binarise=binarise)
+            chosen = detect(osd_thumbnail(image)) if language == "auto" else language
+            cold = chosen not in apis
+            api = api_for(chosen)
+            api.SetImage(image)
+            parser = TsvParser()
+            parser.feed(TSV_HEADER)
+            for line in api.GetTSVText(0).splitlines():
+                parser.feed(line)
+            api.Clear()
+            result = scale_boxes(parser.result(), x_scale, y_scale)
+            if language == "auto":
+                result = result._replace(language=chosen)
+            send(("ok", result, cold))
+        except Exception as exc:
+            send(("error", repr(exc), False))
+
+    for api in apis.values():
+        api.End()
+    if osd is not None:
+        osd.End()
+
+
+class OcrWorker:
+    """one `python -m utils.ocr` process"""
+    def __init__(self, proc):
+        self.proc = proc
+        self.jobs = 0
+        self.broken = False
+        self.load_time = None
+
+    @classmethod
+    async def spawn(cls, languages):
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "utils.ocr", *languages,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE
+        )
+        worker = cls(proc)
+        try:
+            # models are loaded before anything is sent back
+            status, worker.load_time, _ = await worker._receive()
+        except BaseException:
+            worker.close()
+            raise
+        if status != "ready":
+            worker.close()
+            raise TessError(status)
+        return worker
+
+    async def _receive(self):
+        try:
+            header = await self.proc.stdout.readexactly(HEADER.size)
+            return pickle.loads(await self.proc.stdout.readexactly(HEADER.unpack(header)[0]))
+        except asyncio.IncompleteReadError as exc:
+            self.broken = True
+            raise TessError("worker died") from exc
+
+    async def roundtrip(self, data, language, binarise, timeout):
+        self.jobs += 1
+        # anything going wrong mid job leaves the pipes in an unknown state
+        self.broken = True
+        payload = pickle.dumps((data, language, binarise))
+        try:
+            self.proc.stdin.write(HEADER.pack(len(payload)) + payload)
+            await self.proc.stdin.drain()
+            status, result, cold = await asyncio.wait_for(self._receive(), timeout=timeout)
+        except (BrokenPipeError, ConnectionResetError) as exc:
+            raise TessError("worker died") from exc
+        self.broken = False
+        if status != "ok":
+            raise TessError(result)
+        return result, cold
+
+    def close(self):
+        if self.proc.returncode is None:
+            self.proc.kill()
+
+
+class OcrPool:
+    """long lived tesseract workers over the C API with their models already loaded
+    workers are replaced after max_jobs jobs (tesseract leaks a bit), or when they die or time out
+    """
+    def __init__(self, metrics, *, size, max_jobs, languages):
+        self.metrics = metrics
+        self.size = size
+        self.max_jobs = max_jobs
+        self.languages = languages
+        self._idle = asyncio.Queue()
+        self._workers = set()
+        self._replacing = set()
+        self.closed = False
+
+    @property
+    def ready(self):
+        return tesserocr is not None and bool(self._workers)
+
+    async def start(self):
+        if tesserocr is None:
+            raise TessError("tesserocr isnt installed")
+        # each worker takes jobs as soon as its models are loaded, not once the slowest one is
+        workers = await asyncio.gather(*(self._spawn() for _ in range(self.size)), return_exceptions=True)
+        for worker in workers:
+            if isinstance(worker, BaseException):
+                LOGGER.error("couldnt start ocr worker", exc_info=worker)
+        if not self._workers:
+            raise TessError("no ocr workers started")
+
+    async def _spawn(self):
+        worker = await OcrWorker.spawn(self.languages)
+        if self.closed:
+            worker.close()
+            raise TessError("pool closed")
+        self._workers.add(worker)
+        self._idle.put_nowait(worker)
+        self.metrics["tess:worker_start"].add(worker.load_time * 1000)
+        return worker
+
+    def close(self):
+        self.closed = True
+        for task in self._replacing:
+            task.cancel()
+        for worker in self._workers:
+            worker.close()
+        self._workers.clear()
+
+    async def run(self, data, language, *, binarise, timeout):
+        """ocr the original image bytes, preprocessing happens in the worker too
+        timeout covers waiting for a free worker as well as the job itself
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        async with asyncio.timeout_at(deadline):
+            worker = await self._idle.get()
+        started = time.perf_counter()
+        job = asyncio.create_task(worker.roundtrip(data, language, binarise, deadline - loop.time()))
+        # the worker only goes back once its job is actually over, even if whoever asked gets cancelled
+        job.add_done_callback(lambda _: self._release(worker))
+        result, cold = await asyncio.shield(job)
+        elapsed = (time.perf_counter() - started) * 1000
+        self.metrics["tess:ocr:cold" if cold else "tess:ocr:warm"].add(elapsed)
+        if result.language:
+            self.metrics[f"tess:ocr:auto:{result.language}"].add(elapsed)
+        return result
+
+    def _release(self, worker):
+        if self.closed:
+            worker.close()
+        elif worker.broken or worker.jobs >= self.max_jobs:
+            task = asyncio.create_task(self._replace(worker))
+            self._replacing.add(task)
+            task.add_done_callback(self._replacing.discard)
+        else:
+            self._idle.put_nowait(worker)
+
+    async def _replace(self, worker):
+        self._workers.discard(worker)
+        worker.close()
+        delay = 5.0
+        while not self.closed:
+            try:
+                await self._spawn()
+            except Exception as exc:
+                if self.closed:
+                    return
+                LOGGER.error(f"couldnt replace ocr worker, trying again in {delay:.0f}s", exc_info=exc)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 300.0)
+            else:
+                return
+
+if __name__ == "__main__":
+    # through the real module so results unpickle as utils.ocr.TessResult and not __main__.TessResult
+    from utils.ocr import _worker_main
+    _worker_main(sys.argv[1:])